@@ -0,0 +1,447 @@
+"""This module benchmarks the operations the simulations spend their time in:
+    Stream property access in each state mode, Turbine.get_st2, the
+    HeatExchanger and Evaporator calculations, TroughCollector.L_per_q_m and
+    v_s, the three DishCollector fsolve entry points, get_T_o answered by a
+    ResultCache and the sweeps of the diagrams.
+    Each case reports its wall time per call, as the best of `repeat` runs,
+    both with the Props cache warm (`time`) and cleared before each call
+    (`time_cold`), and its property work per call counted from a cleared
+    cache: `property_calls` are the PropsSI and PropsSI_multi calls,
+    `coolprop_calls` the ones that missed the cache plus the states evaluated
+    by PropsSI_array. The counts do not depend on the machine, so any rise of
+    them is a regression; the times are compared with a tolerance.
+    `python Benchmark.py --save` writes the results as the JSON baseline,
+    `python Benchmark.py` compares against it and exits with 1 on a regression.
+    `python Benchmark.py --profile FOLDED` profiles the property calls of the
+    cases instead, see Props.enable_profiling.
+    """
+import json
+import os
+import platform
+import tempfile
+import time
+import warnings
+import numpy as np
+import CoolProp
+import Props
+from Stream import Stream
+from StreamArray import StreamArray
+from Turbine import Turbine
+from HeatExchanger import HeatExchanger
+from Evaporator import Evaporator
+from TroughCollector import TroughCollector
+from DishCollector import DishCollector
+from ResultCache import ResultCache
+from Saturation import saturation_table
+import Const
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks.json')
+
+CASES = {}      # Set-up functions of the cases, keyed on case names, each returns the operation to time
+
+
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@case('stream_single_phase')
+def _stream_single_phase():
+    st = Stream()
+    st.pressure = 1e6
+
+    def operation():
+        st.temperature = 500
+        return st.h, st.s, st.cp
+    return operation
+
+
+@case('stream_two_phase_pressure')
+def _stream_two_phase_pressure():
+    # Pressure-dependent two phase stream, the temperature follows the pressure
+    st = Stream()
+    st.quality = 0.5
+
+    def operation():
+        st.pressure = 1e6
+        return st.h, st.s
+    return operation
+
+
+@case('stream_two_phase_temperature')
+def _stream_two_phase_temperature():
+    # Temperature-dependent two phase stream, the pressure follows the temperature
+    st = Stream(pressure_dependent=False)
+    st.quality = 0.5
+
+    def operation():
+        st.temperature = 450
+        return st.h, st.s
+    return operation
+
+
+@case('stream_set_ph')
+def _stream_set_ph():
+    st = Stream()
+
+    def operation():
+        st.set_ph(1e6, 2.5e6)
+        return st.h, st.s
+    return operation
+
+
+@case('stream_array')
+def _stream_array():
+    st = StreamArray(1000)
+    st.pressure = np.linspace(1e5, 1e7, 1000)
+
+    def operation():
+        st.temperature = 600
+        return st.h, st.s
+    return operation
+
+
+def _steam(T=663.15, P=2.35e6, flow_rate=32.09 / 3.6):
+    st = Stream()
+    st.temperature = T
+    st.pressure = P
+    st.flow_rate[0] = flow_rate
+    return st
+
+
+@case('turbine_get_st2')
+def _turbine_get_st2():
+    tb = Turbine()
+    st1 = _steam()
+    st2 = Stream()
+    return lambda: tb.get_st2(st1, 1.5e4, out=st2)
+
+
+def _heat_exchanger(cls=HeatExchanger):
+    # Oil heating water, all four streams set
+    he = cls()
+    for st, fluid, T, P, flow_rate in ((he.st1_i, Const.FLUID[3], 600, 2e6, 10),
+                                       (he.st1_o, Const.FLUID[3], 500, 2e6, 10),
+                                       (he.st2_i, Const.FLUID[1], 350, 5e6, 5),
+                                       (he.st2_o, Const.FLUID[1], 450, 5e6, 5)):
+        st.fluid = fluid
+        st.temperature = T
+        st.pressure = P
+        st.flow_rate[0] = flow_rate
+    return he
+
+
+for _name in ('calc_st1_i', 'calc_st1_o', 'calc_st2_i', 'calc_st2_o'):
+    case('heat_exchanger_' + _name)(lambda name=_name: getattr(_heat_exchanger(), name))
+
+
+@case('heat_exchanger_rate')
+def _heat_exchanger_rate():
+    # Single phase: the oil enters below the saturation temperature of the water
+    he = _heat_exchanger()
+    he.UA = 2e4
+    he.st1_i.temperature = 500
+    return he.rate
+
+
+@case('evaporator_rate')
+def _evaporator_rate():
+    ev = _heat_exchanger(Evaporator)
+    ev.UA = 1.5e5
+    ev.st1_i.temperature = 660
+    ev.st1_i.flow_rate[0] = 30
+    ev.st2_i.temperature = 400
+    ev.st2_i.pressure = 2.35e6
+    ev.st2_i.flow_rate[0] = 6
+    return ev.rate
+
+
+def _trough():
+    tc = TroughCollector()
+    tc.st_i.temperature = 400
+    tc.st_i.pressure = 2e6
+    tc.st_o.temperature = 500
+    tc.st_o.pressure = 2e6
+    return tc
+
+
+@case('trough_L_per_q_m')
+def _trough_L_per_q_m():
+    tc = _trough()
+    return lambda: tc.L_per_q_m
+
+
+@case('trough_v_s')
+def _trough_v_s():
+    tc = _trough()
+    return lambda: tc.v_s
+
+
+def _dish(T_o=None):
+    dc = DishCollector()
+    dc.st_i.fluid = Const.FLUID[2]
+    dc.st_i.temperature = Const.convert_temperature(150, 'C', 'K')
+    dc.st_i.pressure = 4e5
+    dc.st_i.flow_rate[0] = 0.07
+    dc.st_o.fluid = Const.FLUID[2]
+    dc.st_o.pressure = 4e5
+    if T_o is not None:
+        dc.st_o.temperature = T_o
+    dc.amb.irradiance = 700
+    return dc
+
+
+@case('dish_get_dot_m')
+def _dish_get_dot_m():
+    dc = _dish(Const.convert_temperature(240, 'C', 'K'))
+    return dc.get_dot_m
+
+
+@case('dish_get_T_o')
+def _dish_get_T_o():
+    return _dish().get_T_o
+
+
+@case('dish_get_A')
+def _dish_get_A():
+    dc = _dish(Const.convert_temperature(240, 'C', 'K'))
+
+    def operation():
+        dc.A = 19
+        dc.get_A()
+    return operation
+
+
+@case('dish_get_T_o_result_cache')
+def _dish_get_T_o_result_cache():
+    # get_T_o answered by a ResultCache on disk
+    directory = tempfile.TemporaryDirectory()
+    dc = _dish()
+    dc.result_cache = ResultCache(os.path.join(directory.name, 'results.sqlite'))
+    dc.get_T_o()
+
+    def operation():
+        directory       # The cache file lives as long as the case
+        dc.get_T_o()
+    return operation
+
+
+@case('dish_residual')
+def _dish_residual():
+    # One residual evaluation of get_T_o at its solution
+    dc = _dish()
+    dc.get_T_o()
+    x = np.array([dc.airPipe.temperature, dc.insLayer.temperature, dc.st_o.temperature])
+    return lambda: dc.CalcDishCollector2(x)
+
+
+@case('dish_kernels')
+def _dish_kernels():
+    # The heat balance terms of a dish receiver from given properties
+    import Kernels
+
+    def operation():
+        return (Kernels.q_dr_1_2(0.07, 1.2, 3e-5, 1100.0, 0.05, 4e-5, 0.07, 0.306, 3.4, 900.0, 423.15, 512.0),
+                Kernels.h_cond_conv(1.8e-5, 1.2, 1006.0, 0.026, 4.0, 0.6),
+                Kernels.q_cond_rad(0.6, 0.9, 320.0, 300.0),
+                Kernels.q_cond_tot(900.0, 320.0, 0.304),
+                Kernels.q_conv_tot(0.045, 1.7e-3, 3.1e-5, 0.58, 900.0, 300.0, 0.785, 0.25, 0.306, 0.8, 4.0),
+                Kernels.q_rad_emit(0.95, 0.049, 900.0, 300.0))
+    return operation
+
+
+@case('ph_diagram_sweep')
+def _ph_diagram_sweep():
+    # The isotherms and the dome of ph_diagram.py
+    P = np.linspace(1e5, 1e8, 1000)
+    st = StreamArray(1000)
+    st.pressure = P
+
+    def operation():
+        for T in range(100, 600, 50):
+            st.temperature_celcius = T
+            st.h
+        table = saturation_table('water')
+        p = np.linspace(1e5, table.P_max, 1000)
+        return table.h_l(p), table.h_g(p)
+    return operation
+
+
+@case('hs_diagram_sweep')
+def _hs_diagram_sweep():
+    # The isotherms and the dome of hs_diagram.py
+    S = np.linspace(1e2, 1e4, 1000)
+    st = StreamArray(1000)
+    p = np.linspace(1e3, Props.PropsSI('P_CRITICAL', 'water'), 1000)
+
+    def operation():
+        for T in range(100, 600, 50):
+            st.temperature_celcius = T
+            st.pressure = Props.PropsSI_array(('P',), 'S', S, 'T', T + 273.15, 'water')[0]
+            st.h
+        return Props.PropsSI_array(('S', 'H'), 'Q', [[0], [1]], 'P', p, 'water')
+    return operation
+
+
+def _count(operation):
+    # Property calls and CoolProp evaluations of one call from a cleared cache
+    Props.clear_cache()
+    operation()
+    info = Props.cache_info()
+    return info.hits + info.misses, info.misses + info.array_states
+
+
+def _time(operation, repeat, min_time, cold):
+    # Best time per call of `repeat` runs, each of enough calls to last min_time
+    number = 1
+    while True:
+        elapsed = _run(operation, number, cold)
+        if elapsed >= min_time or number >= 10000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed
+    for k in range(repeat - 1):
+        best = min(best, _run(operation, number, cold))
+    return best / number
+
+
+def _run(operation, number, cold):
+    clear = Props.clear_cache
+    start = time.perf_counter()
+    if cold:
+        for k in range(number):
+            clear()
+            operation()
+    else:
+        for k in range(number):
+            operation()
+    return time.perf_counter() - start
+
+
+def run(names=None, repeat=5, min_time=0.05):
+    """Run the cases `names`, all of them by default, and return a dict of
+    the time, time_cold, property_calls and coolprop_calls of each case
+    """
+    results = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name in CASES if names is None else names:
+            operation = CASES[name]()
+            # The first call builds the saturation tables and design points
+            operation()
+            property_calls, coolprop_calls = _count(operation)
+            results[name] = {'time': _time(operation, repeat, min_time, False),
+                             'time_cold': _time(operation, repeat, min_time, True),
+                             'property_calls': property_calls,
+                             'coolprop_calls': coolprop_calls}
+    Props.clear_cache()
+    return results
+
+
+def profile(names=None, path=None):
+    """Profile one call of each case from a cleared cache, set-up
+    excluded. Returns the Props.profile_table of the calls and writes their
+    folded stacks to `path` if given.
+    """
+    operations = [CASES[name]() for name in (CASES if names is None else names)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for operation in operations:
+            operation()
+        Props.clear_cache()
+        Props.enable_profiling()
+        try:
+            for operation in operations:
+                operation()
+        finally:
+            Props.disable_profiling()
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(Props.profile_folded() + '\n')
+    return Props.profile_table()
+
+
+def save(results, path=BASELINE):
+    """Write the results into the baseline file, the cases not run are
+    kept from the file
+    """
+    cases = load(path) if os.path.exists(path) else {}
+    cases.update(results)
+    baseline = {'python': platform.python_version(),
+                'coolprop': CoolProp.__version__,
+                'machine': platform.platform(),
+                'cases': cases}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path=BASELINE):
+    with open(path) as f:
+        return json.load(f)['cases']
+
+
+def compare(results, baseline, tolerance=1.0):
+    """Return the regressions of `results` against `baseline`: more property
+    calls or CoolProp evaluations than the baseline, or times more than
+    `tolerance` above it
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for key in ('property_calls', 'coolprop_calls'):
+            if result[key] > base[key]:
+                regressions.append('{0}: {1} {2} -> {3}'.format(name, key, base[key], result[key]))
+        for key in ('time', 'time_cold'):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append('{0}: {1} {2:.4g} -> {3:.4g} ms'.format(
+                    name, key, base[key] * 1e3, result[key] * 1e3))
+    return regressions
+
+
+def report(results, baseline=None):
+    """Return the results as a text table, with the speedup against the
+    baseline times where there is one
+    """
+    lines = ['{0:<30}{1:>12}{2:>12}{3:>10}{4:>10}{5:>10}'.format(
+        'case', 'time, ms', 'cold, ms', 'calls', 'CoolProp', 'speedup')]
+    for name, result in results.items():
+        speedup = ''
+        if baseline is not None and name in baseline:
+            speedup = '{0:.2f}x'.format(baseline[name]['time_cold'] / result['time_cold'])
+        lines.append('{0:<30}{1:>12.4f}{2:>12.4f}{3:>10}{4:>10}{5:>10}'.format(
+            name, result['time'] * 1e3, result['time_cold'] * 1e3,
+            result['property_calls'], result['coolprop_calls'], speedup))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Benchmark the components against a JSON baseline.')
+    parser.add_argument('-k', dest='pattern', default='', help='only run the cases whose name contains PATTERN')
+    parser.add_argument('--baseline', default=BASELINE, help='JSON baseline file')
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='allowed relative rise of the times')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--profile', metavar='FOLDED', help='profile the property calls of the cases instead, '
+                                                           'and write their stacks to FOLDED for flamegraph.pl')
+    args = parser.parse_args()
+    names = [name for name in CASES if args.pattern in name]
+    if args.profile:
+        print(profile(names, args.profile))
+        sys.exit(0)
+    results = run(names, args.repeat)
+    baseline = load(args.baseline) if os.path.exists(args.baseline) else None
+    print(report(results, baseline))
+    if args.save:
+        save(results, args.baseline)
+    elif baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        sys.exit(1 if regressions else 0)
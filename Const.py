@@ -1,5 +1,6 @@
 """This is a module containing constants and fixed functions.
 """
+import math
 import numpy as np
 
 
@@ -24,34 +25,69 @@ FLUID = {1: 'Water', 2: 'Air', 3: 'INCOMP::TVP1',
 """
 
 
-def log_mean(a: float, b: float):
+_NUMBER = (float, int, np.number)
+
+
+def _masked(formula, valid, *args):
+    # Evaluate formula(*args) on arrays of any shape, broadcast against each
+    # other, where valid(*args) holds and NaN elsewhere. Only the valid
+    # elements are evaluated
+    args = np.broadcast_arrays(*[np.asarray(arg, dtype=float) for arg in args])
+    with np.errstate(invalid='ignore'):
+        mask = valid(*args)
+    result = np.full(args[0].shape, np.nan)
+    if mask.any():
+        with np.errstate(all='ignore'):
+            result[mask] = formula(*[arg[mask] for arg in args])
+    return result
+
+
+def log_mean(a, b):
     """
-    This function provides the log mean number of a and b.
+    This function provides the log mean number of a and b, the mean of -a
+    and b if they differ in sign. Works on numbers and on arrays, pairs with
+    a zero number are NaN.
     """
-    if a * b > 0:
-        return (a - b) / np.log(a / b)
-    elif a * b < 0:
-        return log_mean(-a, b)
-    else:
-        print("The two numbers are wrong!")
+    if isinstance(a, _NUMBER) and isinstance(b, _NUMBER):
+        if a * b < 0:
+            a = -a
+        elif a * b == 0:
+            return math.nan
+        return (a + b) / 2 if abs(a - b) < 1e-9 * abs(a) else (a - b) / math.log(a / b)
+    return _masked(_log_mean, _log_mean_valid, a, b)
+
+
+def _log_mean(a, b):
+    a = a * np.sign(a * b)
+    return np.where(np.abs(a - b) < 1e-9 * np.abs(a), (a + b) / 2, (a - b) / np.log(a / b))
+
+
+def _log_mean_valid(a, b):
+    return a * b != 0
 
 
-def convert_temperature(values_to_convert: float, input_temp_unit: str, output_temp_unit: str):
+TEMPERATURE_UNITS = ('K', 'F', 'C', 'R')
+_unit_slope = {'K': 1, 'F': 5 / 9, 'C': 1, 'R': 5 / 9}
+_unit_bias = {'K': 0, 'F': - 273.15 * 9 / 5 + 32, 'C': - 273.15, 'R': 0}
+_conversions = {(unit_i, unit_o): (_unit_slope[unit_i] / _unit_slope[unit_o],
+                                   _unit_bias[unit_o] - _unit_bias[unit_i] * _unit_slope[unit_i] / _unit_slope[unit_o])
+                for unit_i in TEMPERATURE_UNITS for unit_o in TEMPERATURE_UNITS}
+"""Slope and offset of the conversion between each pair of units"""
+
+
+def convert_temperature(values_to_convert, input_temp_unit: str, output_temp_unit: str):
     """
-    This function converts temperature in different units.
+    This function converts temperature in different units. Works on numbers
+    and on arrays.
     """
-    unit = ['K', 'F', 'C', 'R']
-    unit_slope = {'K': 1, 'F': 5 / 9, 'C': 1, 'R': 5 / 9}
-    unit_bias = {'K': 0, 'F': - 273.15 * 9 / 5 + 32, 'C': - 273.15, 'R': 0}
-
-    if (input_temp_unit in unit) and (output_temp_unit in unit):
-        result = (values_to_convert - unit_bias[input_temp_unit]) * \
-                unit_slope[input_temp_unit] / unit_slope[output_temp_unit] \
-                + unit_bias[output_temp_unit]
-        return result
-    else:
+    try:
+        slope, offset = _conversions[(input_temp_unit, output_temp_unit)]
+    except KeyError:
         raise ValueError("The units must be 'K', 'C',"
-                         " 'F' or 'R'. Please check!")
+                         " 'F' or 'R'. Please check!") from None
+    if not isinstance(values_to_convert, _NUMBER):
+        values_to_convert = np.asarray(values_to_convert, dtype=float)
+    return values_to_convert * slope + offset
 
 
 def Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav):
@@ -64,14 +100,28 @@ def Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav):
     :param theta: Aperture angle, rad
     :param d_ap: Aperture diameter, m
     :param d_bar_cav: Effective cavity diameter, m
-    :return: Nu - Nusselt number
+    :return: Nu - Nusselt number, NaN where an input is out of its range
     """
+    if isinstance(Gr, _NUMBER) and isinstance(T_cav, _NUMBER) and isinstance(T_amb, _NUMBER) and \
+            isinstance(theta, _NUMBER) and isinstance(d_ap, _NUMBER) and isinstance(d_bar_cav, _NUMBER):
+        if Gr >= 0 and T_cav > 0 and T_amb > 0 and -math.pi / 2 <= theta <= math.pi / 2 and d_ap > 0 and d_bar_cav > 0:
+            return _Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav)
+        return math.nan
+    return _masked(_Nu_nat_conv, _Nu_nat_conv_valid, Gr, T_cav, T_amb, theta, d_ap, d_bar_cav)
+
+
+def _Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav):
     S = - 0.982 * (d_ap / d_bar_cav) + 1.12
     result = 0.088 * Gr ** (1/3) * (T_cav / T_amb) ** 0.18 \
         * (np.cos(theta)) ** 2.47 * (d_ap / d_bar_cav) ** S
     return result
 
 
+def _Nu_nat_conv_valid(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav):
+    return (Gr >= 0) & (T_cav > 0) & (T_amb > 0) & (-np.pi / 2 <= theta) & (theta <= np.pi / 2) & \
+        (d_ap > 0) & (d_bar_cav > 0)
+
+
 def Nu_in_pipe(Re, Pr, mu, mu_cav):
     """
     This is a function to get Nusselt number of forced convection in pipes:
@@ -81,12 +131,25 @@ def Nu_in_pipe(Re, Pr, mu, mu_cav):
     :param Pr: Prandtl number
     :param mu: dynamic viscosity in the pipe, N.s/(m^2)
     :param mu_cav: dynamic viscosity in the cavity, N.s/(m^2)
-    :return: Nu - Nusselt number
+    :return: Nu - Nusselt number, NaN where an input is not positive
     """
+    if isinstance(Re, _NUMBER) and isinstance(Pr, _NUMBER) and isinstance(mu, _NUMBER) and \
+            isinstance(mu_cav, _NUMBER):
+        if Re > 0 and Pr > 0 and mu > 0 and mu_cav > 0:
+            return _Nu_in_pipe(Re, Pr, mu, mu_cav)
+        return math.nan
+    return _masked(_Nu_in_pipe, _Nu_in_pipe_valid, Re, Pr, mu, mu_cav)
+
+
+def _Nu_in_pipe(Re, Pr, mu, mu_cav):
     result = 0.027 * Re ** 0.8 * Pr ** (1 / 3) * (mu / mu_cav) ** 0.14
     return result
 
 
+def _Nu_in_pipe_valid(Re, Pr, mu, mu_cav):
+    return (Re > 0) & (Pr > 0) & (mu > 0) & (mu_cav > 0)
+
+
 def Nu_of_external_cylinder(Re, Pr):
     """This is a function to get Nusselt number for flow perpendicular to
      circular cylinder of diameter D, the average heat-transfer coefficient
@@ -95,29 +158,55 @@ def Nu_of_external_cylinder(Re, Pr):
 
      :param Re: Reynold number
      :param Pr: Prandtl number
-     :return: Nu - Nusselt number
+     :return: Nu - Nusselt number, NaN where Re is negative or Pr not positive
      """
+    if isinstance(Re, _NUMBER) and isinstance(Pr, _NUMBER):
+        return _Nu_of_external_cylinder(Re, Pr) if Re >= 0 and Pr > 0 else math.nan
+    return _masked(_Nu_of_external_cylinder, _Nu_of_external_cylinder_valid, Re, Pr)
+
+
+def _Nu_of_external_cylinder(Re, Pr):
     result = 0.3 + 0.62 * Re ** (1/2) * Pr ** (1/3) / (1 + (0.4 / Pr) ** (2/3))\
         ** (1/4) * (1 + (Re / 282000) ** (5/8)) ** (4/5)
     return result
 
 
+def _Nu_of_external_cylinder_valid(Re, Pr):
+    return (Re >= 0) & (Pr > 0)
+
+
+_Re_bounds = np.array([40, 1000, 20000])
+_C = np.array([0.75, 0.51, 0.26, 0.076])
+_m = np.array([0.4, 0.5, 0.6, 0.7])
+"""Coefficients C and exponents m of the Reynolds number ranges of
+   Nu_of_external_cylinder2, bounded by _Re_bounds
+"""
+
+
 def Nu_of_external_cylinder2(Re, Pr_1, Pr_2):
-    if (0.7 < Pr_1 < 500) and (1 < Re < 10 ** 6):
-        n = 0.36 if Pr_1 > 10 else 0.37
-        if Re < 40:
-            C = 0.75
-            m = 0.4
-        elif Re < 1000:
-            C = 0.51
-            m = 0.5
-        elif Re < 20000:
-            C = 0.26
-            m = 0.6
-        else:
-            C = 0.076
-            m = 0.7
-    else:
+    """Nusselt number of the flow across a circular cylinder by the
+    correlation of Zukauskas, for 0.7 < Pr_1 < 500 and 1 < Re < 10^6. Works
+    on numbers and on arrays; numbers out of range raise ValueError, array
+    elements out of range are NaN.
+
+    :param Re: Reynold number
+    :param Pr_1: Prandtl number of the fluid
+    :param Pr_2: Prandtl number of the fluid at the wall temperature
+    :return: Nu - Nusselt number
+    """
+    if isinstance(Re, _NUMBER) and isinstance(Pr_1, _NUMBER) and isinstance(Pr_2, _NUMBER):
+        if _Nu_of_external_cylinder2_valid(Re, Pr_1, Pr_2):
+            return float(_Nu_of_external_cylinder2(Re, Pr_1, Pr_2))
         raise ValueError('Unproper Reynold number or Prandtl number')
-    result = C * Re ** m * Pr_1 ** n * (Pr_1/Pr_2) ** 0.25
+    return _masked(_Nu_of_external_cylinder2, _Nu_of_external_cylinder2_valid, Re, Pr_1, Pr_2)
+
+
+def _Nu_of_external_cylinder2(Re, Pr_1, Pr_2):
+    k = np.searchsorted(_Re_bounds, Re, side='right')
+    n = np.where(Pr_1 > 10, 0.36, 0.37)
+    result = _C[k] * Re ** _m[k] * Pr_1 ** n * (Pr_1/Pr_2) ** 0.25
     return result
+
+
+def _Nu_of_external_cylinder2_valid(Re, Pr_1, Pr_2):
+    return (0.7 < Pr_1) & (Pr_1 < 500) & (1 < Re) & (Re < 10 ** 6) & (Pr_2 > 0)
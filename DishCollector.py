@@ -5,10 +5,50 @@ from Stream import Stream
 from AirPipe import AirPipe
 from InsLayer import InsLayer
 from Ambient import Ambient
-from CoolProp.CoolProp import PropsSI
+from Props import PropsSI, PropsSI_multi, qualify, split_fluid
 import Const
+import Kernels
 from scipy.optimize import fsolve
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, namedtuple
+from itertools import repeat
 import numpy as np
+import functools
+import copy
+import warnings
+import Props
+
+
+BatchResult = namedtuple('BatchResult', ['T_airPipe', 'T_insLayer', 'T_o', 'flow_rate', 'converged', 'message'])
+"""Arrays of the solutions of DishCollector.solve_batch, NaN and a message
+   where a point failed
+"""
+DishGeometry = namedtuple('DishGeometry', ['d_bar_cav', 'A_ap', 'A_cav', 'alpha_eff', 'A_airPipe',
+                                           'd_o', 'A_ins', 'UA_ins'])
+"""Terms of the receiver that only depend on its design: effective cavity
+   diameter, areas (m^2) of the aperture, cavity, air pipe and insulating
+   layer, effective absorptivity of the cavity, outer diameter of the
+   insulating layer (m) and conductance of the insulating layer (W/K)
+"""
+
+_geometries = OrderedDict()     # Receiver geometries, keyed on the design parameters
+_max_geometries = 256           # Geometries kept, the least recently used ones are dropped first
+
+
+def solve_invariant(method):
+    # Terms that do not depend on the unknowns are evaluated once per solve
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self):
+        if self._invariants is None:
+            return method(self)
+        try:
+            return self._invariants[name]
+        except KeyError:
+            value = self._invariants[name] = method(self)
+            return value
+    return wrapper
 
 
 class DishCollector:
@@ -21,6 +61,12 @@ class DishCollector:
     theta = np.deg2rad(45)   # Dish aperture angle(0 is horizontal,
     # pi/2 is vertically down), rad
     A = 23.28         # Aperture area of the collector, m^2
+    backend = None    # Backend mode of the property calls, see Props.qualify
+    analytic_jacobian = True    # Give fsolve the Jacobian of the residuals
+    warm_start = False  # Start from the previous solution of close conditions
+    warm_start_tol = 0.1    # Maximum relative change of the conditions for a warm start
+    result_cache = None     # ResultCache of the solves, None to always solve
+    result_cache_exact = False  # Key the results on the start point too, replaying each solve bit for bit
 
     def __init__(self):
         self.amb = Ambient()
@@ -28,6 +74,19 @@ class DishCollector:
         self.st_o = Stream()
         self.airPipe = AirPipe()
         self.insLayer = InsLayer()
+        self._solutions = {}
+        """Previous solution and its conditions of each solver, keyed on
+           the number of the residual function
+        """
+        self._invariants = None
+        """Terms evaluated once per solve, None outside of a solve
+        """
+        self.nfev = 0   # Residual evaluations of the last solve
+        self.njev = 0   # Jacobian evaluations of the last solve
+        self.property_calls = 0     # Property calls of the last solve
+        self.property_evaluations = 0   # Property calls of the last solve not answered by the cache
+        self.converged = False  # Whether the last solve converged
+        self.message = ''   # Message of fsolve on the last solve
 
     @property
     def q_use(self):
@@ -41,20 +100,65 @@ class DishCollector:
     def eta(self):
         return self.q_use / self.q_tot
 
+    @property
+    @solve_invariant
+    def geometry(self):
+        """The DishGeometry of the receiver. It is evaluated once per design
+        and shared by all collectors of that design; changing a geometric
+        parameter selects the geometry of the new design.
+        """
+        airPipe, insLayer = self.airPipe, self.insLayer
+        key = (self.d_ap, self.d_cav, self.dep_cav, airPipe.d_i, airPipe.delta_a, airPipe.alpha,
+               insLayer.d_i, insLayer.delta, insLayer.lamb)
+        try:
+            _geometries.move_to_end(key)
+            return _geometries[key]
+        except KeyError:
+            pass
+        d_bar_cav = self.d_cav - airPipe.d_i - 2 * airPipe.delta_a
+        A_ap = np.pi * self.d_ap ** 2 / 4
+        A_cav = np.pi * d_bar_cav ** 2 / 4 + \
+            np.pi * d_bar_cav * self.dep_cav + \
+            np.pi * (d_bar_cav ** 2 - self.d_ap ** 2) / 4
+        # Effective absorptivity of the cavity
+        alpha_eff = airPipe.alpha / (airPipe.alpha + (1 - airPipe.alpha) * (A_ap / A_cav))
+        # Heat transfer area of the helical air pipe
+        H_prime_c = airPipe.d_i + 2 * airPipe.delta_a
+        N = np.floor(self.dep_cav / H_prime_c)
+        H_c = self.dep_cav / N
+        L_c = N * np.sqrt((np.pi * self.d_cav)**2 + H_c**2)
+        A_airPipe = np.pi * airPipe.d_i * L_c
+        d_o = insLayer.d_i + 2 * insLayer.delta
+        A_ins = np.pi * d_o * (self.dep_cav + insLayer.delta)
+        UA_ins = 2 * np.pi * insLayer.lamb * self.dep_cav / np.log(d_o / insLayer.d_i)
+        geometry = DishGeometry(*(float(value) for value in (d_bar_cav, A_ap, A_cav, alpha_eff, A_airPipe,
+                                                             d_o, A_ins, UA_ins)))
+        _geometries[key] = geometry
+        if len(_geometries) > _max_geometries:
+            _geometries.popitem(last=False)
+        return geometry
+
     @property
     def d_bar_cav(self):
-        return self.d_cav - self.airPipe.d_i - 2 * self.airPipe.delta_a
+        return self.geometry.d_bar_cav
 
     @property
     def A_ins(self):
-        d_o = self.insLayer.d_i + 2 * self.insLayer.delta
-        return np.pi * d_o * (self.dep_cav + self.insLayer.delta)
+        return self.geometry.A_ins
 
     @property
     def A_cav(self):
-        return np.pi * self.d_bar_cav ** 2 / 4 + \
-            np.pi * self.d_bar_cav * self.dep_cav + \
-            np.pi * (self.d_bar_cav ** 2 - self.d_ap ** 2) / 4
+        return self.geometry.A_cav
+
+    @property
+    def alpha_eff(self):
+        # Effective absorptivity of the cavity
+        return self.geometry.alpha_eff
+
+    @property
+    def A_airPipe(self):
+        # Heat transfer area of the helical air pipe, m^2
+        return self.geometry.A_airPipe
 
     def q_in(self):
         # The accepted energy from the reflector, W
@@ -63,113 +167,208 @@ class DishCollector:
     def q_dr_1_1(self):
         # The absorbed heat of the air, W
         h_o = PropsSI('H', 'T', self.st_o.temperature,
-                      'P', self.st_o.pressure, self.st_o.fluid)
+                      'P', self.st_o.pressure, qualify(self.st_o.fluid, self.backend))
         h_i = PropsSI('H', 'T', self.st_i.temperature,
-                      'P', self.st_i.pressure, self.st_i.fluid)
+                      'P', self.st_i.pressure, qualify(self.st_i.fluid, self.backend))
         return self.st_i.flow_rate[0] * (h_o - h_i)
 
     def q_dr_1_2(self):
         #  Heat transferred from the air pipe to the air, W
         average_temperature = (self.st_i.temperature + self.st_o.temperature)/2
         average_pressure = (self.st_i.pressure + self.st_o.pressure)/2
-        density = PropsSI('D', 'T', average_temperature, 'P', average_pressure, self.st_i.fluid)
-        v = 4 * self.st_i.flow_rate[0] / (np.pi * self.airPipe.d_i ** 2 * density)
-        mu = PropsSI('V', 'T', average_temperature, 'P', average_pressure, self.st_i.fluid)
-        re = density * v * self.airPipe.d_i / mu
-        cp = PropsSI('C', 'T', average_temperature, 'P', average_pressure, self.st_i.fluid)
-        k = PropsSI('L', 'T', average_temperature, 'P', average_pressure, self.st_i.fluid)
-        pr = cp * mu / k
-        mu_cav = PropsSI('V', 'T', self.airPipe.temperature, 'P', average_pressure, self.st_i.fluid)
-        Nu_prime = Const.Nu_in_pipe(re, pr, mu, mu_cav)
-
-        c_r = 1 + 3.5 * self.airPipe.d_i / (self.d_cav - self.airPipe.d_i
-                                            - 2 * self.airPipe.delta_a)
-        Nu = c_r * Nu_prime
-
-        h = Nu * k / self.airPipe.d_i
-
-        H_prime_c = self.airPipe.d_i + 2 * self.airPipe.delta_a
-        N = np.floor(self.dep_cav / H_prime_c)
-        H_c = self.dep_cav / N
-        L_c = N * np.sqrt((np.pi * self.d_cav)**2 + H_c**2)
-        A_airPipe = np.pi * self.airPipe.d_i * L_c
-
-        DeltaT1 = self.airPipe.temperature - self.st_i.temperature
-        DeltaT2 = self.airPipe.temperature - self.st_o.temperature
-        DeltaT = Const.log_mean(DeltaT1, DeltaT2)
-
-        return h * A_airPipe * DeltaT
+        density, mu, cp, k = PropsSI_multi(('D', 'V', 'C', 'L'), 'T', average_temperature,
+                                           'P', average_pressure, qualify(self.st_i.fluid, self.backend))
+        mu_cav = PropsSI('V', 'T', self.airPipe.temperature, 'P', average_pressure,
+                         qualify(self.st_i.fluid, self.backend))
+        geometry = self.geometry
+        return Kernels.q_dr_1_2(self.st_i.flow_rate[0], density, mu, cp, k, mu_cav, self.airPipe.d_i,
+                                geometry.d_bar_cav, geometry.A_airPipe, self.airPipe.temperature,
+                                self.st_i.temperature, self.st_o.temperature)
 
     def q_ref(self):
         # Reflected energy by the receiver, W
-        A_ap = np.pi * self.d_ap ** 2 / 4
-        alpha_eff = self.airPipe.alpha / \
-            (self.airPipe.alpha + (1 - self.airPipe.alpha) *
-             (A_ap / self.A_cav))
-        return self.q_in() * (1 - alpha_eff)
+        return Kernels.q_ref(self.q_in(), self.geometry.alpha_eff)
+
+    @solve_invariant
+    def h_cond_conv(self):
+        # Convection heat transfer coefficient of the insulating layer, W/(m^2 K)
+        mu, density, Cp, k = PropsSI_multi(('V', 'D', 'C', 'L'), 'T', self.amb.temperature,
+                                           'P', self.amb.pressure, qualify(self.amb.fluid, self.backend))
+        return Kernels.h_cond_conv(mu, density, Cp, k, self.amb.wind_speed, self.geometry.d_o)
 
     def q_cond_conv(self):
         # Convection loss from the insulating layer, W
-        mu = PropsSI('V', 'T', self.amb.temperature, 'P', self.amb.pressure, self.amb.fluid)
-        density = PropsSI('D', 'T', self.amb.temperature, 'P',
-                          self.amb.pressure, self.amb.fluid)
-        nu = mu / density
-        d_o = self.insLayer.d_i + 2 * self.insLayer.delta
-        Re = self.amb.wind_speed * d_o / nu
-
-        Cp = PropsSI('C', 'T', self.amb.temperature, 'P', self.amb.pressure, self.amb.fluid)
-        k = PropsSI('L', 'T', self.amb.temperature, 'P', self.amb.pressure, self.amb.fluid)
-        Pr = Cp * mu / k
-
-        Nu = Const.Nu_of_external_cylinder(Re, Pr)
-
-        h = Nu * k / d_o
-        A_ins = self.A_ins
-        return h * A_ins * (self.insLayer.temperature - self.amb.temperature)
+        return Kernels.q_cond_conv(self.h_cond_conv(), self.geometry.A_ins, self.insLayer.temperature,
+                                   self.amb.temperature)
 
     def q_cond_rad(self):
         # Radiated energy from the insulating layer, W
-        return self.insLayer.epsilon * self.A_ins * \
-                Const.SIGMA * (self.insLayer.temperature ** 4 - self.amb.temperature ** 4)
+        return Kernels.q_cond_rad(self.insLayer.epsilon, self.geometry.A_ins, self.insLayer.temperature,
+                                  self.amb.temperature)
 
     def q_cond_tot(self):
         # Heat loss from air pipe to the insulating layer, W
-        d_o = self.insLayer.d_i + 2 * self.insLayer.delta
-        return (self.airPipe.temperature - self.insLayer.temperature) / \
-            (np.log(d_o / self.insLayer.d_i) /
-             (2 * np.pi * self.insLayer.lamb * self.dep_cav))
+        return Kernels.q_cond_tot(self.airPipe.temperature, self.insLayer.temperature, self.geometry.UA_ins)
 
     def q_conv_tot(self):
         # Total convection loss, W
         average_temperature = (self.airPipe.temperature + self.amb.temperature) / 2
         # Film temperature is used
-        k = PropsSI('L', 'T', average_temperature, 'P', self.amb.pressure, self.amb.fluid)
-
-        beta = PropsSI('ISOBARIC_EXPANSION_COEFFICIENT',
-                       'T', average_temperature, 'P', self.amb.pressure, self.amb.fluid)
-        mu = PropsSI('V', 'T', average_temperature, 'P', self.amb.pressure, self.amb.fluid)
-        density = PropsSI('D', 'T', average_temperature, 'P', self.amb.pressure, self.amb.fluid)
-        nu = mu / density
-        Gr = Const.G * beta * (self.airPipe.temperature - self.amb.temperature) * \
-            self.d_bar_cav ** 3 / nu ** 2
-
-        Nu = Const.Nu_nat_conv(Gr, self.airPipe.temperature, self.amb.temperature, self.theta,
-                               self.d_ap, self.d_bar_cav)
-        h_nat = k * Nu / self.d_bar_cav
-
-        h_for = 0.1967 * self.amb.wind_speed ** 1.849
-
-        return (h_nat + h_for) * self.A_cav * (self.airPipe.temperature - self.amb.temperature)
+        k, beta, mu, density = PropsSI_multi(('L', 'ISOBARIC_EXPANSION_COEFFICIENT', 'V', 'D'),
+                                             'T', average_temperature, 'P', self.amb.pressure,
+                                             qualify(self.amb.fluid, self.backend))
+        geometry = self.geometry
+        return Kernels.q_conv_tot(k, beta, mu, density, self.airPipe.temperature, self.amb.temperature,
+                                  self.theta, self.d_ap, geometry.d_bar_cav, geometry.A_cav, self.amb.wind_speed)
 
     def q_rad_emit(self):
         # Emitted radiation loss, W
-        A_ap = np.pi * self.d_ap ** 2 / 4
-        alpha_eff = self.airPipe.alpha / \
-            (self.airPipe.alpha + (1 - self.airPipe.alpha) *
-             (A_ap / self.A_cav))
-        epsilon_cav = alpha_eff
-        return epsilon_cav * A_ap * Const.SIGMA * \
-            (self.airPipe.temperature ** 4 - self.amb.temperature ** 4)
+        geometry = self.geometry
+        return Kernels.q_rad_emit(geometry.alpha_eff, geometry.A_ap, self.airPipe.temperature, self.amb.temperature)
+
+    def _set_unknowns(self, x, n):
+        # Set the unknowns x of the residual function CalcDishCollector<n>
+        self.airPipe.temperature = x[0]
+        self.insLayer.temperature = x[1]
+        if n == 1:
+            self.st_i.flow_rate[0] = x[2]
+        elif n == 2:
+            self.st_o.temperature = x[2]
+        else:
+            self.A = x[2]
+
+    def _partial(self, q, x, n, i):
+        # Forward difference of the heat flow q() with respect to unknown i
+        base = q()
+        x_step = np.array(x, dtype=float)
+        step = 1e-7 * max(abs(x_step[i]), 1)
+        x_step[i] += step
+        self._set_unknowns(x_step, n)
+        result = (q() - base) / step
+        self._set_unknowns(x, n)
+        return result
+
+    def jacobian(self, x, n):
+        """Jacobian of the residual function CalcDishCollector<n> at x.
+        The radiation, conduction, optical and air enthalpy terms are
+        differentiated analytically. The convection terms, whose
+        coefficients depend on transport properties, are differentiated by
+        forward differences of those terms only, which needs a few
+        property calls instead of three full residual evaluations.
+        """
+        self._set_unknowns(x, n)
+        T_a, T_ins = self.airPipe.temperature, self.insLayer.temperature
+        geometry = self.geometry
+        c_cond = geometry.UA_ins
+
+        d_q_dr_1_1 = np.zeros(3)
+        d_q_dr_1_2 = np.array([self._partial(self.q_dr_1_2, x, n, 0), 0, 0])
+        d_q_in = np.zeros(3)
+        if n == 1:
+            d_q_dr_1_1[2] = self.q_dr_1_1() / self.st_i.flow_rate[0]
+            # The Nusselt number in the air pipe is proportional to Re ** 0.8
+            d_q_dr_1_2[2] = 0.8 * self.q_dr_1_2() / self.st_i.flow_rate[0]
+        elif n == 2:
+            d_q_dr_1_1[2] = self.st_i.flow_rate[0] * \
+                PropsSI('C', 'T', self.st_o.temperature, 'P', self.st_o.pressure,
+                        qualify(self.st_o.fluid, self.backend))
+            d_q_dr_1_2[2] = self._partial(self.q_dr_1_2, x, n, 2)
+        else:
+            d_q_in[2] = self.q_in() / self.A
+        d_q_ref = d_q_in * (1 - geometry.alpha_eff)
+        d_q_cond_tot = np.array([c_cond, -c_cond, 0])
+        d_q_cond_conv = np.array([0, self.h_cond_conv() * geometry.A_ins, 0])
+        d_q_cond_rad = np.array([0, 4 * self.insLayer.epsilon * geometry.A_ins * Const.SIGMA * T_ins ** 3, 0])
+        d_q_conv_tot = np.array([self._partial(self.q_conv_tot, x, n, 0), 0, 0])
+        d_q_rad_emit = np.array([4 * geometry.alpha_eff * geometry.A_ap * Const.SIGMA * T_a ** 3, 0, 0])
+        return np.array([d_q_dr_1_1 - d_q_dr_1_2,
+                         d_q_cond_tot - d_q_cond_conv - d_q_cond_rad,
+                         d_q_dr_1_1 + d_q_ref + (d_q_cond_tot + d_q_conv_tot + d_q_rad_emit)
+                         - d_q_in])
+
+    def _conditions(self, n):
+        # Known inputs of the solver CalcDishCollector<n>, compared for a warm start
+        known = [self.amb.irradiance, self.amb.temperature, self.amb.wind_speed,
+                 self.st_i.temperature, self.st_i.pressure]
+        if n != 1:
+            known.append(self.st_i.flow_rate[0])
+        if n != 2:
+            known.append(self.st_o.temperature)
+        if n != 3:
+            known.append(self.A)
+        return np.array(known, dtype=float)
+
+    def _solve(self, n, guess):
+        # Solve CalcDishCollector<n> = 0 and leave the collector at the solution
+        conditions = self._conditions(n)
+        if self.warm_start and n in self._solutions:
+            x_previous, conditions_previous = self._solutions[n]
+            if np.all(np.abs(conditions - conditions_previous) <=
+                      self.warm_start_tol * np.abs(conditions_previous)):
+                guess = x_previous
+        if self.result_cache is not None:
+            inputs = self._cache_inputs(n, conditions, guess)
+            result = self.result_cache.get('DishCollector' + str(n), inputs)
+            if result is not None:
+                x, self.converged, self.message = np.array(result[0]), result[1], result[2]
+                self._set_unknowns(x, n)
+                self.nfev = self.njev = self.property_calls = self.property_evaluations = 0
+                if self.converged:
+                    self._solutions[n] = (x, conditions)
+                return x
+        residual = getattr(self, 'CalcDishCollector' + str(n))
+        fprime = (lambda x: self.jacobian(x, n)) if self.analytic_jacobian else None
+        info_start = Props.cache_info()
+        self._invariants = {}
+        try:
+            x, info, ier, mesg = fsolve(residual, guess, fprime=fprime, full_output=True)
+            self._set_unknowns(x, n)
+        finally:
+            self._invariants = None
+        info_end = Props.cache_info()
+        self.property_calls = info_end.hits + info_end.misses - info_start.hits - info_start.misses
+        self.property_evaluations = info_end.misses - info_start.misses
+        self.nfev = info['nfev']
+        self.njev = info.get('njev', 0)
+        self.converged = ier == 1
+        self.message = mesg
+        if ier == 1:
+            self._solutions[n] = (x, conditions)
+        if self.result_cache is not None and (self.converged or self.result_cache_exact):
+            # A failed solve may converge from another start point
+            self.result_cache.put('DishCollector' + str(n), inputs, [x, self.converged, self.message])
+        return x
+
+    def _cache_inputs(self, n, conditions, guess):
+        # Physical inputs of the solution of CalcDishCollector<n> besides the
+        # model code: the conditions, the fluids and backends, the design and
+        # the rounding of the property cache. The converged solution does not
+        # depend on the start point but within the solver tolerance, so the
+        # same operating point hits whatever solve reached it first; with
+        # result_cache_exact the start point and the Jacobian are keyed too
+        airPipe, insLayer, amb = self.airPipe, self.insLayer, self.amb
+        inputs = [conditions, amb.pressure, split_fluid(qualify(self.st_i.fluid, self.backend)),
+                  split_fluid(qualify(amb.fluid, self.backend)), Props.cache_info().digits,
+                  self.gamma, self.rho, self.shading, self.theta, self.d_ap, self.d_cav,
+                  self.dep_cav, airPipe.d_i, airPipe.delta_a, airPipe.alpha, insLayer.d_i, insLayer.delta,
+                  insLayer.lamb, insLayer.epsilon]
+        if self.result_cache_exact:
+            inputs += [guess, self.analytic_jacobian]
+        return inputs
+
+    def _residual(self, x, n):
+        # Residuals of CalcDishCollector<n>, each heat flow is evaluated once
+        #   F{1} = q_dr_1_1 - q_dr_1_2
+        #   F{2} = q_cond_tot - q_cond_conv - q_cond_rad
+        #   F{3} = q_dr_1_1 + q_ref + (q_cond_tot + q_conv_tot + q_rad_emit) - q_in
+        self._set_unknowns(x, n)
+        q_dr_1_1 = self.q_dr_1_1()
+        q_cond_tot = self.q_cond_tot()
+        q_in = self.q_in()
+        return np.array([q_dr_1_1 - self.q_dr_1_2(),
+                         q_cond_tot - self.q_cond_conv() - self.q_cond_rad(),
+                         q_dr_1_1 + q_in * (1 - self.geometry.alpha_eff) +
+                         (q_cond_tot + self.q_conv_tot() + self.q_rad_emit()) - q_in])
 
     def CalcDishCollector1(self, x):
         # CalcDishCollector Use expressions to calculation parameters of dish
@@ -178,30 +377,18 @@ class DishCollector:
         #   Second expression expresses q_cond_tot = q_cond_conv + q_cond_rad
         #   Third expression expresses q_in = q_ref + q_dr_1 + q_cond_tot +
         #   q_conv_tot + q_rad_emit
-        self.airPipe.temperature = x[0]
-        self.insLayer.temperature = x[1]
-        self.st_i.flow_rate[0] = x[2]
-        # F = cell(3,1)
-        # F{1} = dc.q_dr_1_1 - dc.q_dr_1_2
-        # F{2} = dc.q_cond_tot - dc.q_cond_conv - dc.q_cond_rad
-        # F{3} = dc.q_dr_1_1 + dc.q_ref + (dc.q_cond_tot ...
-        #                 + dc.q_conv_tot + dc.q_rad_emit) - dc.q_in
-        return np.array([self.q_dr_1_1() - self.q_dr_1_2(),
-                        self.q_cond_tot() - self.q_cond_conv() - self.q_cond_rad(),
-                        self.q_dr_1_1() + self.q_ref() +
-                        (self.q_cond_tot() + self.q_conv_tot() + self.q_rad_emit())
-                        - self.q_in()])
+        return self._residual(x, 1)
 
     def get_dot_m(self):
         # Known inlet and outlet temperature to calculate the flow rate
         self.st_o.fluid = self.st_i.fluid
-        self.st_o.flow_rate = self.st_i.flow_rate
+        self.st_o.share_flow_rate(self.st_i)
         # Assume no pressure loss
         self.st_o.pressure = self.st_i.pressure
         self.st_o.pressure = self.st_i.pressure
         guess = np.array([500, 300, 0.1])
         # options = optimset('Display','iter')
-        fsolve(self.CalcDishCollector1, guess)
+        self._solve(1, guess)
 
     def CalcDishCollector2(self, x):
         # CalcDishCollector Use expressions to calculation parameters of dish
@@ -210,31 +397,19 @@ class DishCollector:
         #   Second expression expresses q_cond_tot = q_cond_conv + q_cond_rad
         #   Third expression expresses q_in = q_ref + q_dr_1 + q_cond_tot +
         #   q_conv_tot + q_rad_emit
-        self.airPipe.temperature = x[0]
-        self.insLayer.temperature = x[1]
-        self.st_o.temperature = x[2]
-        #      F = cell(3,1)
-        #      F{1} = self gc.q_dr_1_1 - dc.q_dr_1_2
-        #      F{2} = self gc.q_cond_tot - dc.q_cond_conv - dc.q_cond_rad
-        #      F{3} = self gc.q_dr_1_1 + dc.q_ref + (dc.q_cond_tot ...
-        #          + self gc.q_conv_tot + dc.q_rad_emit) - dc.q_in
-        return np.array([self.q_dr_1_1() - self.q_dr_1_2(),
-                        self.q_cond_tot() - self.q_cond_conv() - self.q_cond_rad(),
-                        self.q_dr_1_1() + self.q_ref() +
-                         (self.q_cond_tot() + self.q_conv_tot() +
-                         self.q_rad_emit()) - self.q_in()])
+        return self._residual(x, 2)
 
     def get_T_o(self):
         # Known inlet temperature and flow rate to calculate outlet
         # temperature
         self.st_o.fluid = self.st_i.fluid
-        self.st_o.flow_rate = self.st_i.flow_rate
+        self.st_o.share_flow_rate(self.st_i)
         # Assume no pressure loss
         self.st_o.pressure = self.st_i.pressure
         self.st_o.pressure = self.st_i.pressure
         guess = np.array([1500, 400, 1000])
         # options = optimset('Display','iter')
-        fsolve(self.CalcDishCollector2, guess)
+        self._solve(2, guess)
 
     def CalcDishCollector3(self, x):
         # CalcDishCollector Use expressions to calculation parameters of dish
@@ -243,33 +418,92 @@ class DishCollector:
         #   Second expression expresses q_cond_tot = q_cond_conv + q_cond_rad
         #   Third expression expresses q_in = q_ref + q_dr_1 + q_cond_tot +
         #   q_conv_tot + q_rad_emit
-        self.airPipe.temperature = x[0]
-        self.insLayer.temperature = x[1]
-        self.A = x[2]
-        #     F = cell(3,1)
-        #     F{1} = self.q_dr_1_1 - self.q_dr_1_2
-        #     F{2} = self.q_cond_tot - self.q_cond_conv - self.q_cond_rad
-        #     F{3} = self.q_dr_1_1 + self.q_ref + (self.q_cond_tot ...
-        #         + self.q_conv_tot + self.q_rad_emit) - self.q_in
-        return np.array([self.q_dr_1_1() - self.q_dr_1_2(),
-                        self.q_cond_tot() - self.q_cond_conv() - self.q_cond_rad(),
-                        self.q_dr_1_1() + self.q_ref() + (self.q_cond_tot() +
-                                                          self.q_conv_tot() +
-                                                          self.q_rad_emit())
-                        - self.q_in()])
+        return self._residual(x, 3)
 
     def get_A(self):
         # Known inlet and outlet fluids to calculate the aperture area
         self.st_o.fluid = self.st_i.fluid
-        self.st_o.flow_rate = self.st_i.flow_rate
+        self.st_o.share_flow_rate(self.st_i)
         # Assume no pressure loss
         self.st_o.pressure = self.st_i.pressure
         self.st_o.pressure = self.st_i.pressure
         guess = np.array([500, 300, 19])
         # options = optimset('Display','iter')
-        x = fsolve(self.CalcDishCollector3, guess)
+        x = self._solve(3, guess)
         self.A = x[2]
 
+    def solve_batch(self, irradiance, T_i, wind_speed, P_i=None, T_amb=None,
+                    flow_rate=None, T_o=None, processes=1, chunksize=None):
+        """Solve many operating points of dishes of this design, e.g. a
+        field of dishes. The conditions are arrays (or numbers) that are
+        broadcast against each other. Give the flow rate to solve the outlet
+        temperature (get_T_o), or the outlet temperature to solve the flow
+        rate (get_dot_m). P_i and T_amb default to the inlet pressure and
+        ambient temperature of this collector. The points are solved one
+        after another with warm starts, or in chunks over `processes`
+        worker processes. A point that fails is NaN with its message in
+        the result instead of aborting the batch.
+        """
+        if (flow_rate is None) == (T_o is None):
+            raise ValueError('Either the flow rate or the outlet temperature must be given!')
+        n, known = (2, flow_rate) if T_o is None else (1, T_o)
+        P_i = self.st_i.pressure if P_i is None else P_i
+        T_amb = self.amb.temperature if T_amb is None else T_amb
+        columns = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in
+                                        (irradiance, T_i, P_i, wind_speed, T_amb, known)])
+        shape = columns[0].shape
+        points = list(zip(*[column.ravel().tolist() for column in columns]))
+        template = copy.deepcopy(self)
+        if processes == 1 or len(points) < 2:
+            rows = _solve_points(template, n, points)
+        else:
+            if chunksize is None:
+                chunksize = max(1, -(-len(points) // (processes * 4)))
+            chunks = [points[i:i + chunksize] for i in range(0, len(points), chunksize)]
+            rows = []
+            with ProcessPoolExecutor(processes) as executor:
+                for chunk_rows in executor.map(_solve_points, repeat(template), repeat(n), chunks):
+                    rows.extend(chunk_rows)
+        if not rows:
+            empty = np.empty(shape)
+            return BatchResult(empty, empty, empty, empty, np.empty(shape, dtype=bool), np.empty(shape, dtype=object))
+        T_airPipe, T_insLayer, T_out, dot_m, converged, message = zip(*rows)
+        return BatchResult(np.reshape(T_airPipe, shape), np.reshape(T_insLayer, shape),
+                           np.reshape(T_out, shape), np.reshape(dot_m, shape),
+                           np.reshape(converged, shape), np.reshape(np.array(message, dtype=object), shape))
+
+
+def _solve_points(dc, n, points):
+    # Solve CalcDishCollector<n> of dish collector dc at each point of
+    # (irradiance, T_i, P_i, wind_speed, T_amb, known), where known is the
+    # outlet temperature for n = 1 and the flow rate for n = 2
+    dc.warm_start = True
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for irradiance, T_i, P_i, wind_speed, T_amb, known in points:
+            dc.amb.irradiance = irradiance
+            dc.amb.wind_speed = wind_speed
+            dc.amb.temperature = T_amb
+            dc.st_i.temperature = T_i
+            dc.st_i.pressure = P_i
+            try:
+                if n == 1:
+                    dc.st_o.temperature = known
+                    dc.get_dot_m()
+                else:
+                    dc.st_i.flow_rate[0] = known
+                    dc.get_T_o()
+            except (ValueError, TypeError, ArithmeticError) as error:
+                rows.append((np.nan, np.nan, np.nan, np.nan, False, str(error)))
+                continue
+            if dc.converged:
+                rows.append((dc.airPipe.temperature, dc.insLayer.temperature,
+                             dc.st_o.temperature, dc.st_i.flow_rate[0], True, ''))
+            else:
+                rows.append((np.nan, np.nan, np.nan, np.nan, False, dc.message))
+    return rows
+
 
 if __name__ == '__main__':
     dc = DishCollector()
@@ -1,7 +1,180 @@
-import HeatExchanger
-from Stream import Stream
+"""This class defines evaporators, heat exchangers in counterflow whose cold
+    fluid (st2) is preheated, evaporated and superheated by the hot fluid
+    (st1), or whose hot fluid condenses.
+    Along the exchanger, the temperature of each fluid is taken as piecewise
+    linear in its enthalpy, with breakpoints at its saturated liquid and vapor
+    enthalpies from the saturation table and `segments` breakpoints evaluated
+    at once inside each single phase zone. The exchanger is split into zones
+    at the breakpoints of both fluids, the conductance of each zone is exact
+    for the linear profiles and the pinch point is at a zone boundary. The
+    breakpoints are kept per inlet state, so rating again needs no property
+    call but the outlet states. `profile` evaluates the exact temperatures
+    over segments as a check.
+    """
+from collections import namedtuple
+import numpy as np
+from scipy.optimize import brentq
+from HeatExchanger import HeatExchanger
+from Props import PropsSI, PropsSI_array, qualify
+from Saturation import saturation_table
+import Const
+
+
+Profile = namedtuple('Profile', ['q', 'T1', 'T2'])
+"""Temperatures of the hot (T1) and cold (T2) fluid, K, against the heat q
+   received by the cold fluid from its inlet, W
+"""
+Pinch = namedtuple('Pinch', ['DeltaT', 'q', 'T1', 'T2'])
 
 
 class Evaporator(HeatExchanger):
-    st1_o = Stream()
-    st1_o.quality = 1
+    segments = 8        # Interior breakpoints of each single phase zone
+
+    def __init__(self, eta=1):
+        super().__init__(eta)
+        self._curve_cache = {}
+        """Piecewise linear T(h) of the fluids, keyed on their inlet state
+           and end temperature
+        """
+
+    def _curve(self, st, T_end):
+        # Breakpoints of the piecewise linear T(h) of a fluid between its
+        # inlet state and the temperature T_end, sorted by enthalpy: the
+        # saturation points and `segments` points in each single phase zone
+        key = (st.fluid, st.temperature, st.pressure, st.quality, T_end, self.backend, self.segments)
+        try:
+            return self._curve_cache[key]
+        except KeyError:
+            pass
+        fluid = qualify(st.fluid, self.backend)
+        T_low, T_high = sorted((st.temperature, T_end))
+        edges = [T_low, T_high]
+        saturation = []
+        table = saturation_table(st.fluid)
+        if table is not None and table.covers(st.pressure):
+            T_sat = table.T(st.pressure)
+            if T_low < T_sat < T_high:
+                edges.insert(1, T_sat)
+                saturation = [(table.h_l(st.pressure), T_sat), (table.h_g(st.pressure), T_sat)]
+        T = np.concatenate([np.linspace(a, b, self.segments + 2)[1:-1] for a, b in zip(edges[:-1], edges[1:])])
+        h = PropsSI_array(('H',), 'T', T, 'P', st.pressure, fluid)[0]
+        points = list(zip(h.tolist(), T.tolist())) + saturation
+        points.append((st.h, st.temperature))
+        points.append((PropsSI('H', 'T', T_end, 'P', st.pressure, fluid), T_end))
+        points.sort()
+        curve = np.array([point[0] for point in points]), np.array([point[1] for point in points])
+        if len(self._curve_cache) > 1000:
+            self._curve_cache.clear()
+        self._curve_cache[key] = curve
+        return curve
+
+    def _curves(self):
+        return self._curve(self.st1_i, self.st2_i.temperature), self._curve(self.st2_i, self.st1_i.temperature)
+
+    def q_max(self, curves=None):
+        """Largest heat released by the hot fluid that keeps the hot fluid
+        hotter than the cold fluid everywhere, W. The temperature
+        difference at a breakpoint of either fluid falls linearly with the
+        heat, so each breakpoint limits the heat in closed form, the
+        inlets of both fluids included.
+        """
+        (h1, T1), (h2, T2) = self._curves() if curves is None else curves
+        m1, m2 = self.st1_i.flow_rate[0], self.st2_i.flow_rate[0]
+        h1_i, h2_i = self.st1_i.h, self.st2_i.h
+        q_cold = (h2 - h2_i) * m2 / self.eta + m1 * (h1_i - np.interp(T2, T1, h1))
+        q_hot = (np.interp(T1, T2, h2) - h2_i) * m2 / self.eta + m1 * (h1_i - h1)
+        return float(min(q_cold.min(), q_hot.min()))
+
+    def nodes(self, q, curves=None):
+        """Zone boundaries for the heat q released by the hot fluid, as a
+        Profile of the linear temperature profiles
+        """
+        (h1, T1), (h2, T2) = self._curves() if curves is None else curves
+        m1, m2 = self.st1_i.flow_rate[0], self.st2_i.flow_rate[0]
+        q_c = q * self.eta
+        h2_i = self.st2_i.h
+        h1_o = self.st1_i.h - q / m1
+        # The hot fluid leaves where the cold fluid enters
+        z = np.concatenate(([0, q_c], (h2 - h2_i) * m2, (h1 - h1_o) * self.eta * m1))
+        z.sort()
+        z = z[(z >= 0) & (z <= q_c)]
+        return Profile(z, np.interp(h1_o + z / (self.eta * m1), h1, T1), np.interp(h2_i + z / m2, h2, T2))
+
+    def pinch(self, q, curves=None):
+        """Smallest temperature difference between the fluids for the heat
+        q released by the hot fluid, and where it is
+        """
+        z, T1, T2 = self.nodes(q, curves)
+        k = np.argmin(T1 - T2)
+        return Pinch(T1[k] - T2[k], z[k], T1[k], T2[k])
+
+    def UA_required(self, q, curves=None):
+        """Conductance that transfers the heat q released by the hot fluid,
+        W/K, the sum of the conductances of the zones
+        """
+        z, T1, T2 = self.nodes(q, curves)
+        DeltaT = T1 - T2
+        if DeltaT.min() <= 0:
+            return np.inf
+        # Logarithmic mean temperature difference of each zone
+        a, b = DeltaT[:-1], DeltaT[1:]
+        mean = (a + b) / 2
+        unequal = np.abs(a - b) > 1e-9 * a
+        mean[unequal] = (a - b)[unequal] / np.log(a[unequal] / b[unequal])
+        return float(((z[1:] - z[:-1]) / mean).sum())
+
+    def rate(self):
+        """Rate the evaporator of conductance UA zone by zone. Sets st1_o and
+        st2_o from st1_i and st2_i and returns the heat released by the hot
+        fluid, W.
+        """
+        if self.UA is None:
+            raise ValueError('The conductance UA of the heat exchanger is not set!')
+        if self.st1_i.temperature <= self.st2_i.temperature:
+            raise ValueError('The hot fluid should be hotter than the cold fluid!')
+        curves = self._curves()
+        q_limit = self.q_max(curves) * (1 - 1e-9)
+        if self.UA_required(q_limit, curves) <= self.UA:
+            q = q_limit
+        else:
+            q = brentq(lambda q: self.UA_required(q, curves) - self.UA, 0, q_limit, xtol=1e-7 * q_limit)
+        self._set_outlets(q)
+        return q
+
+    def profile(self, q, segments=50):
+        """Exact temperatures of both fluids over `segments` segments for
+        the heat q released by the hot fluid, as a Profile
+        """
+        m1, m2 = self.st1_i.flow_rate[0], self.st2_i.flow_rate[0]
+        z = np.linspace(0, q * self.eta, segments + 1)
+        T1 = PropsSI_array(('T',), 'P', self.st1_i.pressure, 'H', self.st1_i.h - q / m1 + z / (self.eta * m1),
+                           qualify(self.st1_i.fluid, self.backend))[0]
+        T2 = PropsSI_array(('T',), 'P', self.st2_i.pressure, 'H', self.st2_i.h + z / m2,
+                           qualify(self.st2_i.fluid, self.backend))[0]
+        return Profile(z, T1, T2)
+
+
+if __name__ == '__main__':
+    import time
+    # Steam generator of a trough plant: oil heats, evaporates and
+    # superheats water
+    ev = Evaporator()
+    ev.UA = 1.5e5
+    ev.st1_i.fluid = Const.FLUID[3]
+    ev.st1_i.temperature = 660
+    ev.st1_i.pressure = 2e6
+    ev.st1_i.flow_rate[0] = 30
+    ev.st2_i.fluid = Const.FLUID[1]
+    ev.st2_i.temperature = 400
+    ev.st2_i.pressure = 2.35e6
+    ev.st2_i.flow_rate[0] = 6
+    q = ev.rate()
+    pinch = ev.pinch(q)
+    print('q = {0:.0f} W, oil out {1:.2f} K, steam out {2:.2f} K, pinch {3:.2f} K at {4:.0f} W'.format(
+        q, ev.st1_o.temperature, ev.st2_o.temperature, pinch.DeltaT, pinch.q))
+    profile = ev.profile(q)
+    print('Exact pinch over 50 segments: {0:.2f} K'.format(np.min(profile.T1 - profile.T2)))
+    start = time.perf_counter()
+    for k in range(1000):
+        ev.rate()
+    print('Rating: {0:.3f} ms per call'.format(time.perf_counter() - start))
@@ -0,0 +1,414 @@
+"""This module describes a plant as a flowsheet: units (components) and the
+    stream connections between them, solved sequential-modularly.
+    The connections form a directed graph of units. Recycle loops are broken
+    at tear streams, the units are calculated in topological order, and the
+    tear streams are converged by direct substitution, Wegstein or Broyden
+    acceleration. A unit is only calculated again when the state of one of its
+    inlet streams changed.
+    In the equation-oriented mode the pressure, enthalpy and flow rate of every
+    connection are unknowns of one system of equations, the outlets of each
+    unit as functions of its inlets. Its Jacobian is sparse, the outlets of a
+    unit only depend on the connections feeding that unit, and it is solved
+    for all streams at once by Newton's method or a trust-region method.
+    """
+import time
+import warnings
+import numpy as np
+from scipy.optimize import root, least_squares
+from scipy.sparse import lil_matrix
+from scipy.sparse.linalg import spsolve, MatrixRankWarning
+import Props
+
+
+VARIABLES = ('pressure', 'h', 'flow_rate')  # Unknowns of each connection
+
+
+class Unit:
+    """A component in a flowsheet. `calculate(component)` calculates the
+    outlet streams of the component from its inlet streams. Inlets and
+    outlets are the names of the stream attributes of the component, e.g.
+    Unit('turbine', tb, lambda tb: ..., inlets=['st_i'], outlets=['st_o_2']).
+    """
+
+    def __init__(self, name, component, calculate, inlets=(), outlets=()):
+        self.name = name
+        self.component = component
+        self.calculate = calculate
+        self.inlets = list(inlets)
+        self.outlets = list(outlets)
+        self.signature = None   # State of the inlet streams at the last calculation
+
+    def stream(self, attribute):
+        return getattr(self.component, attribute)
+
+    def inlet_signature(self):
+        return tuple((st.fluid, st.temperature, st.pressure, st.quality, st.flow_rate[0])
+                     for st in (self.stream(inlet) for inlet in self.inlets))
+
+
+class Flowsheet:
+    def __init__(self, method='wegstein', tol=1e-6, max_iterations=100):
+        self.units = {}
+        self.connections = []
+        """Connections (source unit, outlet, target unit, inlet)
+        """
+        self.method = method
+        """Sequential-modular 'direct', 'wegstein' or 'broyden', or
+        equation-oriented 'newton' or 'trust-region'
+        """
+        self.tol = tol          # Relative tolerance of the tear streams or the residuals
+        self.max_iterations = max_iterations
+        self.iterations = 0     # Passes or Newton iterations of the last solve
+        self.unit_calls = 0     # Unit calculations of the last solve
+        self.nfev = 0           # Residual evaluations of the last equation-oriented solve
+        self.njev = 0           # Jacobian evaluations of the last equation-oriented solve
+        self.property_calls = 0     # Property calls of the last solve
+        self.property_evaluations = 0   # Property calls of the last solve not answered by the cache
+        self.time = 0           # Wall time of the last solve, s
+        self.fixed = set()      # Indices of the unknowns kept fixed, see fix
+        self._base = None       # Unknowns and unit outlets of the last residual evaluation
+
+    def add_unit(self, name, component, calculate, inlets=(), outlets=()):
+        if name in self.units:
+            raise ValueError('Unit {0} is already in the flowsheet!'.format(name))
+        unit = Unit(name, component, calculate, inlets, outlets)
+        self.units[name] = unit
+        return unit
+
+    def connect(self, source, outlet, target, inlet):
+        """Connect the stream `outlet` of unit `source` to the stream
+        `inlet` of unit `target`.
+        """
+        if outlet not in self.units[source].outlets or inlet not in self.units[target].inlets:
+            raise ValueError('Streams {0}.{1} and {2}.{3} can not be connected!'.format(
+                source, outlet, target, inlet))
+        self.connections.append((source, outlet, target, inlet))
+
+    def tear_streams(self):
+        """Return the connections that break every recycle loop, the back
+        edges of a depth-first search started from the units fed from
+        outside of the flowsheet.
+        """
+        successors = {name: [] for name in self.units}
+        fed = set()
+        for connection in self.connections:
+            successors[connection[0]].append(connection)
+            fed.add(connection[2])
+        starts = [name for name in self.units if name not in fed] + list(self.units)
+        state = dict.fromkeys(self.units, 0)    # 0 unvisited, 1 on the path, 2 done
+        tears = []
+        for start in starts:
+            if state[start]:
+                continue
+            state[start] = 1
+            path = [(start, iter(successors[start]))]
+            while path:
+                name, edges = path[-1]
+                for connection in edges:
+                    target = connection[2]
+                    if state[target] == 1:
+                        tears.append(connection)
+                    elif state[target] == 0:
+                        state[target] = 1
+                        path.append((target, iter(successors[target])))
+                        break
+                else:
+                    state[name] = 2
+                    path.pop()
+        return tears
+
+    def order(self, tears=None):
+        # Topological order of the units once the tear streams are removed
+        if tears is None:
+            tears = self.tear_streams()
+        indegree = dict.fromkeys(self.units, 0)
+        successors = {name: [] for name in self.units}
+        for connection in self.connections:
+            if connection not in tears:
+                indegree[connection[2]] += 1
+                successors[connection[0]].append(connection[2])
+        ready = [name for name in self.units if indegree[name] == 0]
+        result = []
+        while ready:
+            name = ready.pop(0)
+            result.append(name)
+            for target in successors[name]:
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    ready.append(target)
+        return result
+
+    def _calculate(self, name):
+        # Calculate a unit when its inlets changed
+        unit = self.units[name]
+        signature = unit.inlet_signature()
+        if signature != unit.signature:
+            unit.calculate(unit.component)
+            unit.signature = signature
+            self.unit_calls += 1
+        return unit
+
+    def _run(self, name, tears):
+        # Calculate a unit and pass its outlets on
+        unit = self._calculate(name)
+        for connection in self.connections:
+            if connection[0] == name and connection not in tears:
+                self.units[connection[2]].stream(connection[3]).assign(unit.stream(connection[1]))
+
+    def _stream_values(self, connections, side):
+        # Pressure, enthalpy and flow rate of the sources (side 0) or the
+        # targets (side 2) of the connections
+        values = []
+        for connection in connections:
+            st = self.units[connection[side]].stream(connection[side + 1])
+            values.extend((st.pressure, st.h, st.flow_rate[0]))
+        return np.array(values, dtype=float)
+
+    def _set_streams(self, connections, values):
+        # Set the targets of the connections from pressure, enthalpy and flow rate
+        for i, connection in enumerate(connections):
+            st = self.units[connection[2]].stream(connection[3])
+            pressure, h, flow_rate = values[3 * i:3 * i + 3]
+            st.set_ph(pressure, h)
+            st.flow_rate[0] = flow_rate
+
+    def _pass(self, tears, order):
+        for name in order:
+            self._run(name, tears)
+        self.iterations += 1
+        return self._stream_values(tears, 0)
+
+    def solve(self):
+        """Calculate every unit once, then iterate the units in order
+        until the tear streams converge, or solve the equations of all
+        streams at once with method 'newton' or 'trust-region'. The target
+        streams of the tear streams must hold an initial guess. Returns the
+        number of passes or iterations.
+        """
+        tears = self.tear_streams()
+        order = self.order(tears)
+        self.iterations = 0
+        self.unit_calls = 0
+        self.nfev = 0
+        self.njev = 0
+        self._base = None
+        for unit in self.units.values():
+            unit.signature = None
+        for connection in tears:
+            st = self.units[connection[2]].stream(connection[3])
+            if st.pressure is None or (st.temperature is None and st.quality is None):
+                raise ValueError('Tear stream {2}.{3} needs an initial guess!'.format(*connection))
+        start = time.perf_counter()
+        info_start = Props.cache_info()
+        try:
+            if self.method in ('newton', 'trust-region'):
+                self._solve_simultaneous(tears, order)
+            else:
+                self._solve_sequential(tears, order)
+        finally:
+            info_end = Props.cache_info()
+            self.property_calls = info_end.hits + info_end.misses - info_start.hits - info_start.misses
+            self.property_evaluations = info_end.misses - info_start.misses
+            self.time = time.perf_counter() - start
+        return self.iterations
+
+    def _solve_sequential(self, tears, order):
+        if not tears:
+            self._pass(tears, order)
+            return
+
+        x = self._stream_values(tears, 2)
+        scale = np.maximum(np.abs(x), 1)
+        if self.method == 'broyden':
+            def residual(y):
+                self._set_streams(tears, y * scale)
+                return self._pass(tears, order) / scale - y
+            solution = root(residual, x / scale, method='broyden1',
+                            options={'maxiter': self.max_iterations, 'fatol': self.tol})
+            self._set_streams(tears, solution.x * scale)
+            self._pass(tears, order)
+            if not solution.success:
+                raise RuntimeError('The tear streams did not converge: ' + solution.message)
+            return
+
+        x_previous = g_previous = None
+        for iteration in range(self.max_iterations):
+            g = self._pass(tears, order)
+            if np.all(np.abs(g - x) <= self.tol * scale):
+                return
+            x_next = g
+            if self.method == 'wegstein' and x_previous is not None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    s = (g - g_previous) / (x - x_previous)
+                q = np.clip(np.nan_to_num(s / (s - 1)), -5, 0)
+                x_next = q * x + (1 - q) * g
+            x_previous, g_previous = x, g
+            x = x_next
+            self._set_streams(tears, x)
+        raise RuntimeError('The tear streams did not converge in {0} passes!'.format(self.max_iterations))
+
+    def fix(self, target, inlet, *variables):
+        """Keep 'pressure', 'h' or 'flow_rate' of the stream `inlet` of unit
+        `target` at its current value in the equation-oriented solve, and
+        drop the balance of that variable over the connection. A closed
+        loop conserves the mass of its fluid but does not set its flow
+        rate, e.g. the flow rate set by the pump is fixed with
+        fs.fix('trough', 'st_i', 'flow_rate').
+        """
+        for j, connection in enumerate(self.connections):
+            if connection[2:] == (target, inlet):
+                break
+        else:
+            raise ValueError('Stream {0}.{1} is not connected!'.format(target, inlet))
+        for variable in variables:
+            if variable not in VARIABLES:
+                raise ValueError("The variable must be 'pressure', 'h' or 'flow_rate'. Please check!")
+            self.fixed.add(3 * j + VARIABLES.index(variable))
+
+    def _residual(self, y, x, scale, free):
+        # Outlets of all units calculated from the free unknowns y (scaled)
+        # minus the unknowns, units whose inlets did not change are skipped
+        x = x.copy()
+        x[free] = y * scale[free]
+        self._set_streams(self.connections, x)
+        for name in self.units:
+            self._calculate(name)
+        self.nfev += 1
+        outlets = self._stream_values(self.connections, 0)
+        self._base = (y.copy(), outlets)
+        return ((outlets - x) / scale)[free]
+
+    def _jacobian(self, y, x, scale, free):
+        """Sparse Jacobian of the residuals by forward differences. An
+        unknown only feeds one unit, so each perturbation recalculates that
+        unit alone and changes only the outlets of that unit.
+        """
+        if self._base is None or not np.array_equal(self._base[0], y):
+            self._residual(y, x, scale, free)
+        outlets = self._base[1]
+        x = x.copy()
+        x[free] = y * scale[free]
+        n = len(self.connections)
+        jacobian = lil_matrix((3 * n, 3 * n))
+        for j in range(3 * n):
+            jacobian[j, j] = -1
+        for name in self.units:
+            rows = [i for i, connection in enumerate(self.connections) if connection[0] == name]
+            columns = [j for j, connection in enumerate(self.connections) if connection[2] == name]
+            for j in columns:
+                connection = self.connections[j]
+                for k in range(3):
+                    if 3 * j + k in self.fixed:
+                        continue
+                    step = 1e-7 * scale[3 * j + k]
+                    perturbed = x[3 * j:3 * j + 3].copy()
+                    perturbed[k] += step
+                    self._set_streams([connection], perturbed)
+                    self._calculate(name)
+                    changed = self._stream_values([self.connections[i] for i in rows], 0)
+                    for position, i in enumerate(rows):
+                        derivative = (changed[3 * position:3 * position + 3] - outlets[3 * i:3 * i + 3]) / step
+                        for m in range(3):
+                            if derivative[m] != 0:
+                                jacobian[3 * i + m, 3 * j + k] += \
+                                    derivative[m] * scale[3 * j + k] / scale[3 * i + m]
+                self._set_streams([connection], x[3 * j:3 * j + 3])
+        self.njev += 1
+        return jacobian.tocsr()[free][:, free].tocsc()
+
+    def _solve_simultaneous(self, tears, order):
+        # One sequential pass from the tear guesses is the starting point
+        self._pass(tears, order)
+        self.iterations = 0
+        x = self._stream_values(self.connections, 2)
+        scale = np.maximum(np.abs(x), 1)
+        free = np.array([j not in self.fixed for j in range(x.size)])
+        y = x[free] / scale[free]
+        args = (x, scale, free)
+        if self.method == 'trust-region':
+            solution = least_squares(self._residual, y, jac=self._jacobian, args=args,
+                                     method='trf', tr_solver='lsmr',
+                                     ftol=None, xtol=self.tol * 1e-3, gtol=None,
+                                     max_nfev=self.max_iterations)
+            f = self._residual(solution.x, *args)
+            self.iterations = self.njev
+        else:
+            f = self._residual(y, *args)
+            while np.max(np.abs(f)) > self.tol:
+                if self.iterations == self.max_iterations:
+                    break
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error', MatrixRankWarning)
+                    try:
+                        step = spsolve(self._jacobian(y, *args), -f)
+                    except MatrixRankWarning:
+                        raise RuntimeError('The stream equations are singular, '
+                                           'please fix the flow rate of closed loops!')
+                norm = np.linalg.norm(f)
+                # Halve the step until the residuals decrease
+                damping = 1
+                while True:
+                    try:
+                        f_new = self._residual(y + damping * step, *args)
+                        if np.linalg.norm(f_new) < norm:
+                            break
+                    except ValueError:
+                        pass
+                    damping /= 2
+                    if damping < 1e-3:
+                        raise RuntimeError('The Newton step does not decrease the residuals!')
+                y = y + damping * step
+                f = f_new
+                self.iterations += 1
+        if not np.max(np.abs(f)) <= self.tol:
+            raise RuntimeError('The stream equations did not converge in {0} iterations!'.format(self.iterations))
+
+
+if __name__ == '__main__':
+    # A solar steam generator: the oil loop of a trough collector field is a
+    # recycle through the oil side of the heat exchanger, the steam drives
+    # the turbine
+    from TroughCollector import TroughCollector
+    from HeatExchanger import HeatExchanger
+    from Turbine import Turbine
+    import Const
+
+    tc = TroughCollector()
+    tc.n = 20
+    tc.amb.irradiance = 800
+    tc.st_i.pressure = 2e6
+    tc.st_i.temperature = 500   # Initial guess of the tear stream
+    tc.st_i.flow_rate[0] = 20
+    tc.st_o.pressure = 2e6
+    tc.st_o.share_flow_rate(tc.st_i)
+
+    he = HeatExchanger(eta=0.98)
+    he.st1_i.fluid = Const.FLUID[3]
+    he.st2_i.temperature = 400
+    he.st2_i.pressure = 2.35e6
+    he.st2_i.flow_rate[0] = 2.35
+    he.st2_o.temperature = 663.15
+    he.st2_o.pressure = 2.35e6
+    he.st2_o.share_flow_rate(he.st2_i)
+
+    tb = Turbine()
+
+    def calculate_turbine(tb):
+        tb.get_st2(tb.st_i, tb._P_c_d, out=tb.st_o_2)
+
+    for method in ('direct', 'wegstein', 'broyden', 'newton', 'trust-region'):
+        tc.st_i.temperature = 500
+        fs = Flowsheet(method=method, max_iterations=500)
+        fs.add_unit('trough', tc, lambda tc: tc.march(50), inlets=['st_i'], outlets=['st_o'])
+        fs.add_unit('exchanger', he, HeatExchanger.calc_st1_o, inlets=['st1_i'], outlets=['st1_o', 'st2_o'])
+        fs.add_unit('turbine', tb, calculate_turbine, inlets=['st_i'], outlets=['st_o_2'])
+        fs.connect('trough', 'st_o', 'exchanger', 'st1_i')
+        fs.connect('exchanger', 'st1_o', 'trough', 'st_i')
+        fs.connect('exchanger', 'st2_o', 'turbine', 'st_i')
+        fs.fix('trough', 'st_i', 'flow_rate')   # The pump sets the flow rate of the oil loop
+        Props.clear_cache()
+        fs.solve()
+        print('{0}: {1} iterations, {2} unit calls, {3} property evaluations, {4:.3f} s, '
+              'oil {5:.2f} K -> {6:.2f} K, turbine outlet quality {7:.4f}'.format(
+                  method, fs.iterations, fs.unit_calls, fs.property_evaluations, fs.time,
+                  tc.st_i.temperature, tc.st_o.temperature, tb.st_o_2.quality))
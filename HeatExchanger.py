@@ -1,14 +1,64 @@
+import math
+import numpy as np
 from Stream import Stream
-from CoolProp.CoolProp import PropsSI
+from Props import PropsSI, qualify
+from Saturation import saturation_table
 import Const
 
 
+def effectiveness(NTU, C_r, arrangement='counter'):
+    """Effectiveness of a heat exchanger with NTU transfer units and the
+    heat capacity rate ratio C_r = C_min / C_max, for 'counter' or
+    'parallel' flow. Works on numbers and on arrays.
+    """
+    if arrangement not in ('counter', 'parallel'):
+        raise ValueError("The flow arrangement must be 'counter' or 'parallel'. Please check!")
+    if np.ndim(NTU) == 0 and np.ndim(C_r) == 0:
+        if arrangement == 'parallel':
+            return (1 - math.exp(-NTU * (1 + C_r))) / (1 + C_r)
+        if abs(1 - C_r) < 1e-9:
+            return NTU / (1 + NTU)
+        e = math.exp(-NTU * (1 - C_r))
+        return (1 - e) / (1 - C_r * e)
+    NTU = np.asarray(NTU, dtype=float)
+    C_r = np.asarray(C_r, dtype=float)
+    if arrangement == 'parallel':
+        return (1 - np.exp(-NTU * (1 + C_r))) / (1 + C_r)
+    e = np.exp(-NTU * (1 - C_r))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(np.abs(1 - C_r) < 1e-9, NTU / (1 + NTU), (1 - e) / (1 - C_r * e))
+
+
+def LMTD(DeltaT_a, DeltaT_b):
+    """Logarithmic mean of the temperature differences at both ends of a
+    counterflow or parallel flow heat exchanger. Works on numbers and on
+    arrays.
+    """
+    if np.ndim(DeltaT_a) == 0 and np.ndim(DeltaT_b) == 0:
+        if abs(DeltaT_a - DeltaT_b) < 1e-9 * abs(DeltaT_a):
+            return (DeltaT_a + DeltaT_b) / 2
+        return (DeltaT_a - DeltaT_b) / math.log(DeltaT_a / DeltaT_b)
+    DeltaT_a = np.asarray(DeltaT_a, dtype=float)
+    DeltaT_b = np.asarray(DeltaT_b, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (DeltaT_a - DeltaT_b) / np.log(DeltaT_a / DeltaT_b)
+    close = np.abs(DeltaT_a - DeltaT_b) < 1e-9 * np.abs(DeltaT_a)
+    if close.any():
+        result[close] = ((DeltaT_a + DeltaT_b) / 2)[close]
+    return result
+
+
 class HeatExchanger:
     """This class defines heat exchangers
         st1 is hot fluid, st2 is cold fluid
+        With a conductance UA, `rate` calculates both outlets from the inlets.
+        The calculated streams are written in place.
     """
     st1_pip = None
     st2_pip = None
+    backend = None      # Backend mode of the property calls, see Props.qualify
+    UA = None           # Conductance, W/K
+    arrangement = 'counter'     # Flow arrangement, 'counter' or 'parallel'
 
     def __init__(self, eta=1):
         self.st1_i = Stream()
@@ -19,75 +69,81 @@ class HeatExchanger:
 
     def pressure_drop(self, st, pip):
         # 等待修改
-        return 0 * st * pip * self.eta
+        return 0
+
+    def _write(self, st, source, pressure, h):
+        # Write the state of a stream of the fluid and flow rate of `source`
+        # in place
+        st.backend = self.backend
+        st.fluid = source.fluid
+        st.share_flow_rate(source)
+        st.set_ph(pressure, h)
 
     def calc_st1_i(self):
-        st1_i = Stream()
-        st1_i.fluid = self.st1_o.fluid
-        st1_i.flow_rate = self.st1_o.flow_rate
-        st1_i.pressure = self.st1_o.pressure + self.pressure_drop(self.st1_o, self.st1_pip)
-        h = self.st1_o.h + (self.st2_i.h - self.st2_o.h) * self.st2_i.flow_rate[0] \
+        h = self.st1_o.h + (self.st2_o.h - self.st2_i.h) * self.st2_i.flow_rate[0] \
             / self.st1_o.flow_rate[0] / self.eta
-        h_l = PropsSI('H', 'P', st1_i.pressure, 'Q', 0, st1_i.fluid)
-        h_g = PropsSI('H', 'P', st1_i.pressure, 'Q', 1, st1_i.fluid)
-        if h_l <= h <= h_g:
-            st1_i.quality = PropsSI('Q', 'P', st1_i.pressure, 'H', h,
-                                    st1_i.fluid)
-        else:
-            st1_i.temperature = PropsSI('T', 'P', st1_i.pressure, 'H', h,
-                                        st1_i.fluid)
-        self.st1_i = st1_i
+        self._write(self.st1_i, self.st1_o,
+                    self.st1_o.pressure + self.pressure_drop(self.st1_o, self.st1_pip), h)
 
     def calc_st1_o(self):
-        st1_o = Stream()
-        st1_o.fluid = self.st1_i.fluid
-        st1_o.flow_rate = self.st1_i.flow_rate
-        st1_o.pressure = self.st1_i.pressure - self.pressure_drop(self.st1_i, self.st1_pip)
-        h = self.st1_i.h - (self.st2_i.h - self.st2_o.h) * self.st2_i.flow_rate[0] \
-            / st1_o.flow_rate[0] / self.eta
-        h_l = PropsSI('H', 'P', st1_o.pressure, 'Q', 0, st1_o.fluid)
-        h_g = PropsSI('H', 'P', st1_o.pressure, 'Q', 1, st1_o.fluid)
-        if h_l <= h <= h_g:
-            st1_o.quality = PropsSI('Q', 'P', st1_o.pressure, 'H', h,
-                                    st1_o.fluid)
-        else:
-            st1_o.T = PropsSI('T', 'P', st1_o.pressure, 'H', h,
-                              st1_o.fluid)
-        self.st1_o = st1_o
+        h = self.st1_i.h - (self.st2_o.h - self.st2_i.h) * self.st2_i.flow_rate[0] \
+            / self.st1_i.flow_rate[0] / self.eta
+        self._write(self.st1_o, self.st1_i,
+                    self.st1_i.pressure - self.pressure_drop(self.st1_i, self.st1_pip), h)
 
     def calc_st2_i(self):
-        st2_i = Stream()
-        st2_i.fluid = self.st2_o.fluid
-        st2_i.flow_rate = self.st2_o.flow_rate
-        st2_i.pressure = self.st2_o.pressure + self.pressure_drop(self.st2_o, self.st2_pip)
-        h = self.st2_o.h + (self.st1_i.h - self.st1_o.h) * self.st1_i.flow_rate[0] \
+        h = self.st2_o.h - (self.st1_i.h - self.st1_o.h) * self.st1_i.flow_rate[0] \
             / self.st2_o.flow_rate[0] * self.eta
-        h_l = PropsSI('H', 'P', st2_i.pressure, 'Q', 0, st2_i.fluid)
-        h_g = PropsSI('H', 'P', st2_i.pressure, 'Q', 1, st2_i.fluid)
-        if h_l <= h <= h_g:
-            st2_i.x = PropsSI('Q', 'P', st2_i.pressure, 'H', h,
-                                   st2_i.fluid)
-        else:
-            st2_i.T = PropsSI('T', 'P', st2_i.pressure, 'H', h,
-                                   self.st2_i.fluid)
-        self.st2_i = st2_i
+        self._write(self.st2_i, self.st2_o,
+                    self.st2_o.pressure + self.pressure_drop(self.st2_o, self.st2_pip), h)
 
     def calc_st2_o(self):
-        st2_o = Stream()
-        st2_o.fluid = self.st2_i.fluid
-        st2_o.flow_rate = self.st2_i.flow_rate
-        st2_o.pressure = self.st2_i.pressure - self.pressure_drop(self.st2_i, self.st2_pip)
-        h = self.st2_i.h - (self.st1_i.h - self.st1_o.h) * self.st1_i.flow_rate[0] \
-            / st2_o.flow_rate[0] / self.eta
-        h_l = PropsSI('H', 'P', st2_o.pressure, 'Q', 0, st2_o.fluid)
-        h_g = PropsSI('H', 'P', st2_o.pressure, 'Q', 1, st2_o.fluid)
-        if h_l <= h <= h_g:
-            st2_o.x = PropsSI('Q', 'P', st2_o.pressure, 'H', h,
-                              st2_o.fluid)
-        else:
-            st2_o.temperature = PropsSI('T', 'P', st2_o.pressure, 'H', h,
-                                        st2_o.fluid)
-        self.st2_o = st2_o
+        h = self.st2_i.h + (self.st1_i.h - self.st1_o.h) * self.st1_i.flow_rate[0] \
+            / self.st2_i.flow_rate[0] * self.eta
+        self._write(self.st2_o, self.st2_i,
+                    self.st2_i.pressure - self.pressure_drop(self.st2_i, self.st2_pip), h)
+
+    def _set_outlets(self, q):
+        # Outlets of both fluids with heat q released by the hot fluid
+        h1 = self.st1_i.h - q / self.st1_i.flow_rate[0]
+        h2 = self.st2_i.h + q * self.eta / self.st2_i.flow_rate[0]
+        self._write(self.st1_o, self.st1_i, self.st1_i.pressure - self.pressure_drop(self.st1_i, self.st1_pip), h1)
+        self._write(self.st2_o, self.st2_i, self.st2_i.pressure - self.pressure_drop(self.st2_i, self.st2_pip), h2)
+
+    @staticmethod
+    def _check_single_phase(st, T_end):
+        # The heat capacity rate of a fluid that evaporates or condenses
+        # between its inlet and T_end would hold its latent heat
+        table = saturation_table(st.fluid)
+        if st.quality is not None or table is not None and table.covers(st.pressure) and \
+                min(st.temperature, T_end) <= table.T(st.pressure) <= max(st.temperature, T_end):
+            raise ValueError('The {0} stream may cross saturation, please rate it with Evaporator.rate!'.format(
+                st.fluid))
+
+    def rate(self):
+        """Rate the heat exchanger of conductance UA by the effectiveness-NTU
+        method, for single phase fluids. The heat capacity rates are the
+        mean ones between the two inlet temperatures. Sets st1_o and st2_o
+        from st1_i and st2_i and returns the heat released by the hot
+        fluid, W. Raises ValueError if either fluid could reach saturation
+        between the inlet temperatures.
+        """
+        if self.UA is None:
+            raise ValueError('The conductance UA of the heat exchanger is not set!')
+        st1, st2 = self.st1_i, self.st2_i
+        DeltaT = st1.temperature - st2.temperature
+        if DeltaT <= 0:
+            raise ValueError('The hot fluid should be hotter than the cold fluid!')
+        self._check_single_phase(st1, st2.temperature)
+        self._check_single_phase(st2, st1.temperature)
+        C1 = st1.flow_rate[0] * (st1.h - PropsSI('H', 'T', st2.temperature, 'P', st1.pressure,
+                                                 qualify(st1.fluid, self.backend))) / DeltaT
+        C2 = st2.flow_rate[0] * (PropsSI('H', 'T', st1.temperature, 'P', st2.pressure,
+                                         qualify(st2.fluid, self.backend)) - st2.h) / DeltaT
+        C_min, C_max = min(C1, C2), max(C1, C2)
+        q = effectiveness(self.UA / C_min, C_min / C_max, self.arrangement) * C_min * DeltaT
+        self._set_outlets(q)
+        return q
 
 
 if __name__ == '__main__':
@@ -111,3 +167,17 @@ if __name__ == '__main__':
     he.calc_st1_o()
     he.calc_st2_i()
     he.calc_st2_o()
+
+    # Rating of an oil to water heater with a given conductance, the water
+    # stays below its saturation temperature of 537 K
+    he = HeatExchanger()
+    he.UA = 2e4
+    he.st1_i.fluid = Const.FLUID[3]
+    he.st1_i.temperature = 500
+    he.st1_i.pressure = 2e6
+    he.st1_i.flow_rate[0] = 10
+    he.st2_i.temperature = 350
+    he.st2_i.pressure = 5e6
+    he.st2_i.flow_rate[0] = 5
+    print('q = {0:.0f} W, oil out {1:.2f} K, water out {2:.2f} K'.format(
+        he.rate(), he.st1_o.temperature, he.st2_o.temperature))
@@ -0,0 +1,168 @@
+"""This module keeps the receiver heat balance terms as kernels: pure
+    arithmetic of numbers, the fluid properties included, with no attribute
+    access or property call. DishCollector and TroughCollector evaluate the
+    properties and pass them in, so a residual evaluation spends its time on
+    the property calls.
+    When Numba is installed the kernels are compiled on their first call and
+    cached on disk (`JIT` is True), otherwise they run as plain Python. The
+    array versions of the correlations are in Const and TroughCollector.
+    Inputs out of the range of a correlation give NaN, as in Const.
+    """
+import math
+from Const import SIGMA, G, _Nu_in_pipe, _Nu_nat_conv, _Nu_of_external_cylinder
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+JIT = njit is not None
+
+U_RECEIVER = ((0.687257, 0.001941, 0.000026),
+              (1.433242, -0.00566, 0.000046),
+              (2.895474, -0.0164, 0.000065))
+"""Coefficients of the quadratic in DeltaT of the trough receiver heat
+   transfer coefficient below 473.15 K, between 473.15 and 573.15 K and
+   above 573.15 K
+"""
+
+
+def kernel(function):
+    # Compile `function` with Numba where it is installed
+    return njit(cache=True)(function) if JIT else function
+
+
+_Nu_in_pipe = kernel(_Nu_in_pipe)
+_Nu_nat_conv = kernel(_Nu_nat_conv)
+_Nu_of_external_cylinder = kernel(_Nu_of_external_cylinder)
+
+
+@kernel
+def log_mean(a, b):
+    # Const.log_mean of two numbers
+    if a * b == 0:
+        return math.nan
+    if a * b < 0:
+        a = -a
+    if abs(a - b) < 1e-9 * abs(a):
+        return (a + b) / 2
+    return (a - b) / math.log(a / b)
+
+
+@kernel
+def Nu_in_pipe(Re, Pr, mu, mu_cav):
+    if Re > 0 and Pr > 0 and mu > 0 and mu_cav > 0:
+        return _Nu_in_pipe(Re, Pr, mu, mu_cav)
+    return math.nan
+
+
+@kernel
+def Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav):
+    if Gr >= 0 and T_cav > 0 and T_amb > 0 and -math.pi / 2 <= theta <= math.pi / 2 and d_ap > 0 and d_bar_cav > 0:
+        return _Nu_nat_conv(Gr, T_cav, T_amb, theta, d_ap, d_bar_cav)
+    return math.nan
+
+
+@kernel
+def Nu_of_external_cylinder(Re, Pr):
+    if Re >= 0 and Pr > 0:
+        return _Nu_of_external_cylinder(Re, Pr)
+    return math.nan
+
+
+@kernel
+def q_dr_1_2(flow_rate, density, mu, cp, k, mu_cav, d_i, d_bar_cav, A_airPipe, T_airPipe, T_i, T_o):
+    # Heat transferred from the air pipe to the air, W, with the properties
+    # of the air at its average state and its viscosity at the pipe wall
+    v = 4 * flow_rate / (math.pi * d_i ** 2 * density)
+    Nu = (1 + 3.5 * d_i / d_bar_cav) * Nu_in_pipe(density * v * d_i / mu, cp * mu / k, mu, mu_cav)
+    return Nu * k / d_i * A_airPipe * log_mean(T_airPipe - T_i, T_airPipe - T_o)
+
+
+@kernel
+def h_cond_conv(mu, density, cp, k, wind_speed, d_o):
+    # Convection heat transfer coefficient of the insulating layer of
+    # outer diameter d_o, W/(m^2 K), with the properties of the ambient air
+    nu = mu / density
+    Nu = Nu_of_external_cylinder(wind_speed * d_o / nu, cp * mu / k)
+    return Nu * k / d_o
+
+
+@kernel
+def q_cond_conv(h, A_ins, T_ins, T_amb):
+    # Convection loss from the insulating layer, W
+    return h * A_ins * (T_ins - T_amb)
+
+
+@kernel
+def q_cond_rad(epsilon, A_ins, T_ins, T_amb):
+    # Radiated energy from the insulating layer, W
+    return epsilon * A_ins * SIGMA * (T_ins ** 4 - T_amb ** 4)
+
+
+@kernel
+def q_cond_tot(T_airPipe, T_ins, UA_ins):
+    # Conduction from the air pipe through the insulating layer of
+    # conductance UA_ins, W
+    return UA_ins * (T_airPipe - T_ins)
+
+
+@kernel
+def q_conv_tot(k, beta, mu, density, T_airPipe, T_amb, theta, d_ap, d_bar_cav, A_cav, wind_speed):
+    # Natural and forced convection loss of the cavity, W, with the
+    # properties of the air at the film temperature
+    nu = mu / density
+    Gr = G * beta * (T_airPipe - T_amb) * d_bar_cav ** 3 / nu ** 2
+    h_nat = k * Nu_nat_conv(Gr, T_airPipe, T_amb, theta, d_ap, d_bar_cav) / d_bar_cav
+    h_for = 0.1967 * wind_speed ** 1.849
+    return (h_nat + h_for) * A_cav * (T_airPipe - T_amb)
+
+
+@kernel
+def q_rad_emit(epsilon_cav, A_ap, T_airPipe, T_amb):
+    # Emitted radiation loss through the aperture of area A_ap, W
+    return epsilon_cav * A_ap * SIGMA * (T_airPipe ** 4 - T_amb ** 4)
+
+
+@kernel
+def q_ref(q_in, alpha_eff):
+    # Reflected energy by the receiver, W
+    return q_in * (1 - alpha_eff)
+
+
+@kernel
+def U_receiver(average_temperature, ambient_temperature):
+    # TroughCollector.U_receiver of two numbers
+    if average_temperature < 473.15:
+        a, b, c = U_RECEIVER[0]
+    elif average_temperature > 573.15:
+        a, b, c = U_RECEIVER[2]
+    else:
+        a, b, c = U_RECEIVER[1]
+    DeltaT = average_temperature - ambient_temperature
+    return a + b * DeltaT + c * DeltaT ** 2
+
+
+@kernel
+def K_incidence(phi):
+    # TroughCollector.K_incidence, works on numbers and on arrays
+    return 1 - 2.23073e-4 * phi - 1.1e-4 * phi ** 2 \
+        + 3.18596e-6 * phi ** 3 - 4.85509e-8 * phi ** 4
+
+
+if __name__ == '__main__':
+    import time
+    # The loss terms of a dish receiver at 900 K in 300 K air
+    args = [(q_dr_1_2, (0.07, 1.2, 3e-5, 1100.0, 0.05, 4e-5, 0.07, 0.306, 3.4, 900.0, 423.15, 512.0)),
+            (h_cond_conv, (1.8e-5, 1.2, 1006.0, 0.026, 4.0, 0.6)),
+            (q_cond_rad, (0.6, 0.9, 320.0, 300.0)),
+            (q_cond_tot, (900.0, 320.0, 0.304)),
+            (q_conv_tot, (0.045, 1.7e-3, 3.1e-5, 0.58, 900.0, 300.0, 0.785, 0.25, 0.306, 0.8, 4.0)),
+            (q_rad_emit, (0.95, 0.049, 900.0, 300.0))]
+    print('Numba kernels' if JIT else 'Python kernels, Numba is not installed')
+    for function, arguments in args:
+        function(*arguments)
+        start = time.perf_counter()
+        for k in range(100000):
+            function(*arguments)
+        print('{0}: {1:.6g}, {2:.3f} us per call'.format(
+            function.__name__, function(*arguments), (time.perf_counter() - start) * 10))
@@ -1,42 +1,47 @@
+from StreamArray import StreamArray
 from Stream import Stream
 import numpy as np
-from CoolProp.CoolProp import PropsSI as ps
+from Props import PropsSI_array
+from Sweep import sweep
 import matplotlib.pyplot as plt
 
 T_i = 500   #  初温，˚C
 p_c = 4000  # 排气压力，Pa
 mass_flow_rate = 61.3  # 主汽流量，kg/s
 
-st_i = Stream()
-st_i.temperature_celcius = T_i
-st_i.flow_rate = mass_flow_rate
 
-st_o = Stream()
-st_o.pressure = p_c
+def ideal_efficiency(T_0, p_0):
+    # Ideal efficiency of the Rankine cycle with arrays of inlet
+    # temperatures T_0, ˚C and inlet pressures p_0, Pa
+    st_i = StreamArray(len(T_0))
+    st_i.temperature_celcius = T_0
+    st_i.pressure = p_0
+    st_i.flow_rate[:] = mass_flow_rate
 
-st_c = Stream()
-st_c.pressure = p_c
-st_c.quality = 0
+    st_o = StreamArray(len(T_0))
+    st_o.pressure = p_c
+    st_o.quality = PropsSI_array(('Q',), 'P', st_o.pressure, 'S', st_i.s, 'water')[0]
 
-number = 40    # number组数据，压力从p0增加到p1
-p0 = 10e6
-p1 = 80e6
-p = np.linspace(p0, p1, number)
-T0 = 400
-T1 = 850
-Delta_T = 50
-T = range(T0, T1, Delta_T)
-for j in T:
-    st_i.temperature_celcius = j
-    efficiency_ideal = []
-    for i in range(number):
-        st_i.pressure = p[i]
-        st_o.quality = ps('Q', 'P', st_o.pressure, 'S', st_i.s, 'water')
-        efficiency_ideal.append((st_i.h - st_o.h) / (st_i.h - st_c.h))
-        # print('P = {P:.3e}, eta = {eta:.3f}'.format(P=p[i], eta=efficiency_ideal))
-    plt.plot(p, efficiency_ideal, label = '$T_0$='+str(j)+'˚C')
-plt.legend()
-plt.xlabel("Turbine inlet pressure ($p_0$), Pa")
-plt.ylabel("Ideal efficiency of Rankine cycle ($\eta_i$)")
-plt.title("$p_c$ = 4000 Pa")
-plt.show()
+    st_c = Stream()
+    st_c.pressure = p_c
+    st_c.quality = 0
+    return (st_i.h - st_o.h) / (st_i.h - st_c.h)
+
+
+if __name__ == '__main__':
+    number = 40    # number组数据，压力从p0增加到p1
+    p0 = 10e6
+    p1 = 80e6
+    p = np.linspace(p0, p1, number)
+    T0 = 400
+    T1 = 850
+    Delta_T = 50
+    T = range(T0, T1, Delta_T)
+    result = sweep(ideal_efficiency, {'T_0': T, 'p_0': p}, processes=1, vectorized=True)
+    for j in T:
+        plt.plot(p, result.sel(T_0=j), label = '$T_0$='+str(j)+'˚C')
+    plt.legend()
+    plt.xlabel("Turbine inlet pressure ($p_0$), Pa")
+    plt.ylabel("Ideal efficiency of Rankine cycle ($\eta_i$)")
+    plt.title("$p_c$ = 4000 Pa")
+    plt.show()
@@ -0,0 +1,448 @@
+"""This module is the thermodynamic property layer shared by all components.
+    `PropsSI` has the same signature as CoolProp's PropsSI. Answers for scalar
+    state queries are kept in a process-wide bounded LRU cache, so identical
+    queries, e.g. the ambient air properties on every fsolve residual, are
+    evaluated only once per process.
+    Cache misses are evaluated on a pool of CoolProp low-level AbstractState
+    handles, one per backend and fluid, which are created once and then only
+    updated, instead of letting CoolProp parse the fluid string and build a
+    new backend on every call.
+    The backend mode of the Helmholtz EOS fluids can be switched to CoolProp's
+    tabular TTSE or bicubic interpolation, process-wide with `set_backend` or
+    per fluid string with `qualify`. The tables are built lazily by CoolProp
+    on first use and saved on disk, so later processes start warm. Measured
+    errors against the full EOS are listed in README.md, `check_backend`
+    reproduces them.
+    Profiling is opt-in: between `enable_profiling()` and `disable_profiling()`
+    every property call is timed and counted per caller, output, input pair
+    and fluid, see `profile_stats`, `profile_table` and `profile_folded`.
+    Disabled, it costs one check of a module variable per call.
+    """
+from collections import OrderedDict, namedtuple
+import os
+import sys
+import time
+from CoolProp.CoolProp import PropsSI as _PropsSI
+import CoolProp.CoolProp as CP
+import numpy as np
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'digits', 'array_states'])
+
+_cache = OrderedDict()
+_maxsize = 100000       # Maximum number of cached answers
+_digits = None          # Significant digits of the inputs in cache keys, None for exact keys
+_hits = 0
+_misses = 0
+_array_states = 0      # States evaluated by PropsSI_array, which bypasses the cache
+
+_backend = 'HEOS'       # Backend mode of the Helmholtz EOS fluids
+BACKENDS = ('HEOS', 'TTSE', 'BICUBIC')
+
+_entries = {}           # Profile entries, keyed on (caller, output, inputs, fluid)
+_profile = None         # The profile entries while profiling, None when disabled
+_stacks = None          # Time per call stack, None when not recorded
+_names = {}             # Frame names, keyed on code objects
+LAYER = ('Props', 'Stream', 'StreamArray')
+"""Modules of the property layer, the caller of a property call is the
+   nearest frame outside of them
+"""
+ProfileStat = namedtuple('ProfileStat', ['caller', 'output', 'inputs', 'fluid',
+                                         'calls', 'hits', 'evaluations', 'time'])
+
+_states = {}            # AbstractState handles, keyed on (backend, fluid)
+_indices = {}           # CoolProp parameter indices, keyed on parameter names
+
+
+def split_fluid(fluid):
+    """Split a CoolProp fluid string such as 'INCOMP::TVP1' into
+    its backend and fluid name. Plain fluid names are Helmholtz EOS
+    fluids evaluated in the process-wide backend mode.
+    """
+    if '::' in fluid:
+        backend, name = fluid.split('::', 1)
+        return backend, name
+    if _backend == 'HEOS':
+        return 'HEOS', fluid
+    return _backend + '&HEOS', fluid
+
+
+def qualify(fluid, mode=None):
+    """Return the fluid string that evaluates a Helmholtz EOS fluid in
+    backend mode `mode`, e.g. qualify('Water', 'BICUBIC') returns
+    'BICUBIC&HEOS::Water'. Incompressible fluids such as 'INCOMP::TVP1'
+    are already evaluated from correlations and are returned unchanged,
+    as are fluids when `mode` is None.
+    """
+    if mode is None or mode == 'HEOS' and _backend == 'HEOS':
+        return fluid
+    if mode not in BACKENDS:
+        raise ValueError("The backend mode must be 'HEOS', 'TTSE' or 'BICUBIC'. Please check!")
+    backend, name = fluid.split('::', 1) if '::' in fluid else ('HEOS', fluid)
+    if backend != 'HEOS':
+        return fluid
+    return 'HEOS::' + name if mode == 'HEOS' else mode + '&HEOS::' + name
+
+
+def get_state(fluid, backend=None):
+    """Return the pooled AbstractState handle of a fluid. The handle is
+    shared, so update it right before reading its outputs.
+    """
+    if backend is None:
+        backend, fluid = split_fluid(fluid)
+    key = (backend, fluid)
+    try:
+        return _states[key]
+    except KeyError:
+        state = CP.AbstractState(backend, fluid)
+        _states[key] = state
+        return state
+
+
+def _index(name):
+    try:
+        return _indices[name]
+    except KeyError:
+        index = CP.get_parameter_index(name)
+        _indices[name] = index
+        return index
+
+
+def _evaluate(outputs, args):
+    # Evaluate several outputs of one state with a single update of the
+    # pooled handle
+    if len(args) == 1:
+        # Without inputs the handle holds the last state of another call,
+        # only outputs that do not depend on the state can be read
+        for output in outputs:
+            if not CP.is_trivial_parameter(_index(output)):
+                raise ValueError('The output {0} of {1} is not trivial, it needs a state!'.format(output, args[0]))
+        state = get_state(args[0])
+    else:
+        name1, value1, name2, value2, fluid = args
+        state = get_state(fluid)
+        pair, value1, value2 = CP.generate_update_pair(_index(name1), value1, _index(name2), value2)
+        state = _update(state, fluid, pair, value1, value2)
+    return [state.keyed_output(_index(output)) for output in outputs]
+
+
+def _update(state, fluid, pair, value1, value2):
+    # Update the handle of `fluid` and return it, states outside of the
+    # tables are evaluated by the full EOS
+    try:
+        state.update(pair, value1, value2)
+    except ValueError:
+        backend, name = split_fluid(fluid)
+        if '&' not in backend:
+            raise
+        state = get_state(name, backend.split('&')[1])
+        state.update(pair, value1, value2)
+    return state
+
+
+def _round(value):
+    if _digits is None or not isinstance(value, float) or value == 0:
+        return value
+    return float('{0:.{1}g}'.format(value, _digits))
+
+
+def PropsSI(output, *args):
+    """Drop-in replacement of CoolProp's PropsSI, either
+    PropsSI(output, name1, value1, name2, value2, fluid) or
+    PropsSI(output, fluid) for trivial outputs such as 'P_CRITICAL'.
+    Array inputs are passed to CoolProp without caching.
+    """
+    global _hits, _misses
+    if _profile is not None:
+        return _profiled(PropsSI, (output,) + args, output, args)
+    if len(args) == 5:
+        name1, value1, name2, value2, fluid = args
+        if not (isinstance(value1, (int, float)) and isinstance(value2, (int, float))):
+            return _PropsSI(output, name1, value1, name2, value2, fluid)
+        args = (name1, _round(float(value1)), name2, _round(float(value2)), fluid)
+    key = (output,) + args
+    try:
+        value = _cache[key]
+    except KeyError:
+        _misses += 1
+        value = _evaluate((output,), args)[0]
+        _cache[key] = value
+        if len(_cache) > _maxsize:
+            _cache.popitem(last=False)
+    else:
+        _hits += 1
+        _cache.move_to_end(key)
+    return value
+
+
+def PropsSI_multi(outputs, name1, value1, name2, value2, fluid):
+    """Return a list of several outputs of one state, e.g.
+    PropsSI_multi(('D', 'V', 'C', 'L'), 'T', T, 'P', P, 'Air'). Missing
+    outputs are evaluated together with one update of the pooled handle.
+    """
+    global _hits, _misses
+    if _profile is not None:
+        return _profiled(PropsSI_multi, (outputs, name1, value1, name2, value2, fluid),
+                         ','.join(outputs), (name1, value1, name2, value2, fluid))
+    args = (name1, _round(float(value1)), name2, _round(float(value2)), fluid)
+    values = []
+    for output in outputs:
+        key = (output,) + args
+        try:
+            values.append(_cache[key])
+        except KeyError:
+            break
+        _cache.move_to_end(key)
+    else:
+        _hits += 1
+        return values
+    _misses += 1
+    values = _evaluate(outputs, args)
+    for output, value in zip(outputs, values):
+        _cache[(output,) + args] = value
+    while len(_cache) > _maxsize:
+        _cache.popitem(last=False)
+    return values
+
+
+def PropsSI_array(outputs, name1, values1, name2, values2, fluid):
+    """Evaluate several outputs over arrays of states in one call, e.g.
+    h, s = PropsSI_array(('H', 'S'), 'T', T, 'P', P, 'Water'). The inputs
+    are broadcast against each other and the result has the shape
+    (len(outputs),) + broadcast shape. Each state updates the pooled
+    handle once, elements with NaN inputs or states CoolProp can not
+    evaluate are NaN. The answers bypass the LRU cache.
+    """
+    global _array_states
+    if _profile is not None:
+        return _profiled(PropsSI_array, (outputs, name1, values1, name2, values2, fluid),
+                         ','.join(outputs), (name1, values1, name2, values2, fluid))
+    values1, values2 = np.broadcast_arrays(np.asarray(values1, dtype=float),
+                                           np.asarray(values2, dtype=float))
+    result = np.full((len(outputs),) + values1.shape, np.nan)
+    if values1.size == 0:
+        return result
+    state = get_state(fluid)
+    indices = [_index(output) for output in outputs]
+    # The order of the inputs in the update pair is found once for all states
+    pair, first, _ = CP.generate_update_pair(_index(name1), 1.0, _index(name2), 2.0)
+    flat = result.reshape(len(outputs), -1)
+    if first != 1.0:
+        values1, values2 = values2, values1
+    for j, (value1, value2) in enumerate(zip(values1.ravel().tolist(), values2.ravel().tolist())):
+        if value1 != value1 or value2 != value2:
+            continue
+        _array_states += 1
+        try:
+            evaluated = _update(state, fluid, pair, value1, value2)
+        except ValueError:
+            continue
+        for k, index in enumerate(indices):
+            flat[k, j] = evaluated.keyed_output(index)
+    return result
+
+
+def cache_info():
+    return CacheInfo(_hits, _misses, _maxsize, len(_cache), _digits, _array_states)
+
+
+def clear_cache():
+    global _hits, _misses, _array_states
+    _cache.clear()
+    _hits = 0
+    _misses = 0
+    _array_states = 0
+
+
+def _frame_name(code):
+    try:
+        return _names[code]
+    except KeyError:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        name = code.co_qualname if hasattr(code, 'co_qualname') else code.co_name
+        name = (name if '.' in name else module + '.' + name, module)
+        _names[code] = name
+        return name
+
+
+def _profiled(function, call, output, args):
+    # Time a property call with profiling suspended and record it under its
+    # caller, output, input pair and fluid, and under its call stack
+    global _profile
+    profile = _profile
+    _profile = None
+    hits, misses, array_states = _hits, _misses, _array_states
+    start = time.perf_counter()
+    try:
+        return function(*call)
+    finally:
+        elapsed = time.perf_counter() - start
+        _profile = profile
+        fluid = args[-1]
+        inputs = args[0] + args[2] if len(args) == 5 else ''
+        frame = sys._getframe(2)
+        while frame is not None and _frame_name(frame.f_code)[1] in LAYER:
+            frame = frame.f_back
+        caller = '<unknown>' if frame is None else _frame_name(frame.f_code)[0]
+        key = (caller, output, inputs, fluid)
+        entry = profile.get(key)
+        if entry is None:
+            entry = profile[key] = [0, 0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += _hits - hits
+        entry[2] += _misses - misses + _array_states - array_states
+        entry[3] += elapsed
+        if _stacks is not None:
+            stack = ['{0}({1}|{2}|{3})'.format(function.__name__, output, inputs, fluid)]
+            frame = sys._getframe(2)
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code)[0])
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            _stacks[stack] = _stacks.get(stack, 0.0) + elapsed
+
+
+def enable_profiling(stacks=True):
+    """Start profiling the property calls, the previous profile is
+    dropped. With `stacks`, the time is also recorded per call stack for
+    `profile_folded`.
+    """
+    global _entries, _profile, _stacks
+    _entries = _profile = {}
+    _stacks = {} if stacks else None
+
+
+def disable_profiling():
+    """Stop profiling, the profile is kept until profiling is enabled
+    again
+    """
+    global _profile
+    _profile = None
+
+
+def profile_stats():
+    """Return the profile as a list of ProfileStat, one per caller, output,
+    input pair and fluid, the slowest first. `calls` counts the calls,
+    `hits` the ones answered by the cache, `evaluations` the CoolProp
+    evaluations and `time` the cumulative time, s.
+    """
+    stats = [ProfileStat(*(key + tuple(entry))) for key, entry in _entries.items()]
+    stats.sort(key=lambda stat: stat.time, reverse=True)
+    return stats
+
+
+def profile_table(limit=None):
+    """Return the profile as a text table, the slowest entries first"""
+    stats = profile_stats()[:limit]
+    rows = [('caller', 'output', 'inputs', 'fluid', 'calls', 'hits', 'CoolProp', 'time, ms')]
+    rows += [(stat.caller, stat.output, stat.inputs, stat.fluid, str(stat.calls), str(stat.hits),
+              str(stat.evaluations), '{0:.3f}'.format(stat.time * 1e3)) for stat in stats]
+    widths = [max(len(row[k]) for row in rows) + 2 for k in range(len(rows[0]))]
+    return '\n'.join(''.join(value.ljust(width) if k < 4 else value.rjust(width)
+                              for k, (value, width) in enumerate(zip(row, widths))).rstrip()
+                      for row in rows)
+
+
+def profile_folded():
+    """Return the time per call stack in the folded format of flamegraph.pl
+    and speedscope, one 'outer;...;inner;function(outputs|inputs|fluid) us'
+    line per stack, e.g. 'TroughCollector.v_s;PropsSI(D|TP|INCOMP::TVP1) 12'
+    """
+    if _stacks is None:
+        return ''
+    return '\n'.join('{0} {1}'.format(';'.join(stack), int(round(elapsed * 1e6)))
+                     for stack, elapsed in sorted(_stacks.items()))
+
+
+def set_cache_size(maxsize):
+    """Set the maximum number of cached answers, the least recently
+    used ones are dropped first. 0 disables the cache.
+    """
+    global _maxsize
+    if maxsize < 0:
+        raise ValueError("Cache size should not be negative!")
+    _maxsize = int(maxsize)
+    while len(_cache) > _maxsize:
+        _cache.popitem(last=False)
+
+
+def set_rounding(digits=None):
+    """Round the inputs to `digits` significant digits before looking
+    them up and evaluating them, so nearly identical states share one
+    answer. None keeps exact keys.
+    """
+    global _digits
+    if digits is not None and digits < 1:
+        raise ValueError("Rounding should keep at least 1 significant digit!")
+    _digits = digits
+    _cache.clear()
+
+
+def set_backend(mode='HEOS', tables_directory=None):
+    """Set the process-wide backend mode of the Helmholtz EOS fluids,
+    'HEOS' for the full EOS, 'TTSE' or 'BICUBIC' for CoolProp's tabular
+    interpolation. The tables are saved in `tables_directory`, by default
+    in ~/.CoolProp/Tables.
+    """
+    global _backend
+    if mode not in BACKENDS:
+        raise ValueError("The backend mode must be 'HEOS', 'TTSE' or 'BICUBIC'. Please check!")
+    if tables_directory is not None:
+        CP.set_config_string(CP.ALTERNATIVE_TABLES_DIRECTORY, str(tables_directory))
+    _backend = mode
+    _cache.clear()
+
+
+def check_backend(fluid, mode, outputs=('H', 'S', 'C', 'D'),
+                  T=(300, 800), P=(1e4, 1e7), number=40, margin=15):
+    """Return the maximum relative error of each output of `fluid` in
+    backend mode `mode` against the full EOS, on a `number` x `number`
+    grid of temperatures (K) and log-spaced pressures (Pa) in the single
+    phase region. Subcritical states closer than `margin` K to the
+    saturation temperature are skipped, table cells that straddle the
+    saturation curve may return the properties of the other phase there.
+    """
+    tabular = get_state(fluid, 'HEOS' if mode == 'HEOS' else mode + '&HEOS')
+    exact = get_state(fluid, 'HEOS')
+    errors = dict.fromkeys(outputs, 0.0)
+    for pressure in np.logspace(np.log10(P[0]), np.log10(P[1]), number):
+        try:
+            exact.update(CP.PQ_INPUTS, pressure, 0)
+            T_sat = exact.T()
+        except ValueError:
+            T_sat = None
+        for temperature in np.linspace(T[0], T[1], number):
+            if T_sat is not None and abs(temperature - T_sat) < margin:
+                continue
+            try:
+                exact.update(CP.PT_INPUTS, pressure, temperature)
+                tabular.update(CP.PT_INPUTS, pressure, temperature)
+            except ValueError:
+                continue
+            for output in outputs:
+                value = exact.keyed_output(_index(output))
+                error = abs(tabular.keyed_output(_index(output)) / value - 1)
+                errors[output] = max(errors[output], error)
+    return errors
+
+
+if __name__ == '__main__':
+    # Microbenchmark of uncached property evaluations, CoolProp's PropsSI
+    # against the pooled AbstractState handles
+    queries = [('H', 'T', 'P', 'Water'), ('S', 'T', 'P', 'Water'),
+               ('D', 'T', 'P', 'Air'), ('V', 'T', 'P', 'Air'),
+               ('C', 'T', 'P', 'INCOMP::TVP1')]
+    temperatures = np.linspace(400, 550, 2000)
+    set_cache_size(0)
+    for output, name1, name2, fluid in queries:
+        start = time.perf_counter()
+        for T in temperatures:
+            _PropsSI(output, name1, T, name2, 1e6, fluid)
+        t_ps = time.perf_counter() - start
+        start = time.perf_counter()
+        for T in temperatures:
+            PropsSI(output, name1, T, name2, 1e6, fluid)
+        t_as = time.perf_counter() - start
+        print('{0} of {1}: PropsSI {2:.2f} us, AbstractState {3:.2f} us, {4:.1f}x faster'.format(
+            output, fluid, t_ps / len(temperatures) * 1e6, t_as / len(temperatures) * 1e6, t_ps / t_as))
+    set_cache_size(100000)
@@ -0,0 +1,204 @@
+"""This module keeps the results of expensive component solves on disk, so
+    that repeated studies, notebooks and batch jobs skip CoolProp and fsolve
+    for cases already solved in an earlier process.
+    A result is stored in a SQLite file under a content address: the SHA-256
+    of the solver name, its inputs (conditions and design) and the model
+    version. The model version is a hash of the source of the modules of the
+    model and of the CoolProp version, so editing the model code makes the
+    old results unreachable; `prune` deletes them. When the results exceed
+    `max_bytes`, the least recently used ones are deleted.
+    Components use a cache through their `result_cache` attribute, e.g.
+    `DishCollector.result_cache = ResultCache()` for all dish collectors.
+    """
+from collections import namedtuple
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import time
+import CoolProp.CoolProp as CP
+
+
+MODEL_MODULES = ('Const', 'Kernels', 'Props', 'Stream', 'Saturation', 'Ambient',
+                 'AirPipe', 'InsLayer', 'DishCollector', 'TroughCollector')
+"""Modules whose source enters the model version"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'solar_system', 'results.sqlite')
+
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'entries', 'stale', 'size', 'max_bytes', 'version'])
+"""Hits and misses of this process, entries of the current model version and
+   of other versions, stored bytes, the size limit and the model version
+"""
+
+_versions = {}      # Model versions, keyed on the module names
+
+
+def model_version(modules=MODEL_MODULES):
+    """Hash of the source of `modules` and of the CoolProp version. It
+    changes whenever the code of the model changes.
+    """
+    modules = tuple(modules)
+    try:
+        return _versions[modules]
+    except KeyError:
+        pass
+    digest = hashlib.sha256(CP.get_global_param_string('version').encode())
+    for name in modules:
+        spec = importlib.util.find_spec(name)
+        if spec is None or spec.origin is None:
+            raise ValueError('The source of module {0} is not found!'.format(name))
+        with open(spec.origin, 'rb') as f:
+            digest.update(name.encode() + b'\0' + f.read())
+    version = _versions[modules] = digest.hexdigest()[:16]
+    return version
+
+
+def _plain(value):
+    # NumPy numbers and arrays as Python numbers and lists for JSON
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('{0!r} can not be stored in the result cache!'.format(value))
+
+
+class ResultCache:
+    """Results of component solves in the SQLite file `path`, at most
+    `max_bytes` of them. `version` defaults to the model version of
+    MODEL_MODULES. Inputs and results are JSON values: numbers, strings,
+    booleans, None and lists of them; NumPy numbers and arrays are stored
+    as numbers and lists.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=64 * 2 ** 20, version=None):
+        if max_bytes <= 0:
+            raise ValueError('The size of the result cache should be positive!')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = model_version() if version is None else version
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._size = 0
+        """Stored bytes, read on connecting and kept up to date by this
+           cache; other processes may add to the file in between, so the
+           sum is read again before evicting
+        """
+
+    def __getstate__(self):
+        # A copy, e.g. in a worker process, opens its own connection
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, name TEXT, '
+                               'version TEXT, value TEXT, size INTEGER, used REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._connection = connection
+            self._read_size()
+        return self._connection
+
+    def _read_size(self):
+        self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def key(self, name, inputs):
+        """Content address of the result of solver `name` for `inputs`"""
+        text = json.dumps([name, self.version, inputs], default=_plain, separators=(',', ':'))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, name, inputs):
+        """The stored result of solver `name` for `inputs`, None if there
+        is none
+        """
+        key = self.key(name, inputs)
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, name, inputs, value):
+        """Store `value` as the result of solver `name` for `inputs`. Beyond
+        max_bytes, the least recently used results are deleted down to 90%
+        of it, so the stored bytes are summed again once per tenth of the
+        cache inserted instead of on every insert.
+        """
+        key = self.key(name, inputs)
+        text = json.dumps(value, default=_plain, separators=(',', ':'))
+        size = len(key) + len(text)
+        connection = self.connection
+        row = connection.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                           (key, name, self.version, text, size, time.time()))
+        self._size += size - (0 if row is None else row[0])
+        if self._size <= self.max_bytes:
+            return
+        self._read_size()
+        excess = self._size - 0.9 * self.max_bytes
+        if excess > 0:
+            keys = []
+            for old_key, old_size in connection.execute('SELECT key, size FROM results ORDER BY used'):
+                keys.append((old_key,))
+                excess -= old_size
+                if excess <= 0:
+                    break
+            connection.executemany('DELETE FROM results WHERE key = ?', keys)
+            self._read_size()
+
+    def prune(self):
+        """Delete the results of other model versions, returns their number"""
+        count = self.connection.execute('DELETE FROM results WHERE version != ?', (self.version,)).rowcount
+        self._read_size()
+        return count
+
+    def clear(self):
+        """Delete all results"""
+        self.connection.execute('DELETE FROM results')
+        self._size = 0
+
+    def info(self):
+        """CacheStats of this cache"""
+        entries, stale, size = self.connection.execute(
+            'SELECT COALESCE(SUM(version = ?), 0), COALESCE(SUM(version != ?), 0), COALESCE(SUM(size), 0) '
+            'FROM results', (self.version, self.version)).fetchone()
+        return CacheStats(self.hits, self.misses, entries, stale, size, self.max_bytes, self.version)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+if __name__ == '__main__':
+    import tempfile
+    from DishCollector import DishCollector
+    from Stream import Stream
+    import Const
+    import Props
+    with tempfile.TemporaryDirectory() as directory:
+        DishCollector.result_cache = ResultCache(os.path.join(directory, 'results.sqlite'))
+        for k in range(2):
+            # The second run finds the solves of the first one on disk
+            Props.clear_cache()
+            start = time.perf_counter()
+            dc = DishCollector()
+            dc.st_i = Stream(Const.FLUID[2])
+            dc.st_i.temperature = 423.15
+            dc.st_i.pressure = 4e5
+            dc.st_i.flow_rate[0] = 0.07
+            dc.st_o = Stream(Const.FLUID[2])
+            dc.get_T_o()
+            print('T_o = {0:.2f} K in {1:.2f} ms, {2} property evaluations'.format(
+                dc.st_o.temperature, (time.perf_counter() - start) * 1e3, dc.property_evaluations))
+        print(DishCollector.result_cache.info())
+        DishCollector.result_cache.close()
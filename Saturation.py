@@ -0,0 +1,127 @@
+"""This module keeps a saturation table per fluid: h_l, h_g, s_l, s_g and
+    T_sat against pressure, interpolated by cubic splines in log(P). It answers
+    the two phase checks of the components without calling CoolProp. The
+    table is built on first use from the full EOS, from the triple point up
+    to just below the critical point, and its nodes are doubled until the
+    error at the midpoints of the nodes, relative to the range of each
+    quantity, is below `tol`. Pressures outside of the table are left to
+    CoolProp.
+    """
+import bisect
+import math
+import numpy as np
+from scipy.interpolate import CubicSpline
+import CoolProp.CoolProp as CP
+from Props import PropsSI, PropsSI_array
+
+QUANTITIES = ('h_l', 'h_g', 's_l', 's_g', 'T')
+
+_tables = {}        # Saturation tables, keyed on fluid strings, None for fluids without one
+_names = {}         # Saturation tables, keyed on fluid names
+
+
+class SaturationTable:
+    def __init__(self, name, tol=1e-6, nodes=200, max_nodes=6400, margin=1e-3):
+        self.name = name
+        fluid = 'HEOS::' + name
+        self.P_min = PropsSI('P_TRIPLE', fluid)
+        self.P_max = PropsSI('P_CRITICAL', fluid) * (1 - margin)
+        while True:
+            # The nodes are denser towards the critical point, where the
+            # saturated enthalpies and entropies are steepest
+            u = np.linspace(0, 1, nodes)
+            x = math.log(self.P_min) + (math.log(self.P_max) - math.log(self.P_min)) * (1 - (1 - u) ** 2)
+            self._spline = CubicSpline(x, self._saturation(np.exp(x), fluid).T)
+            x_mid = (x[1:] + x[:-1]) / 2
+            exact = self._saturation(np.exp(x_mid), fluid)
+            span = np.ptp(exact, axis=1, keepdims=True)
+            self.error = float(np.max(np.abs(self._spline(x_mid).T - exact) / span))
+            """Maximum error at the midpoints of the nodes, relative to the
+               range of each quantity
+            """
+            if self.error <= tol or nodes >= max_nodes:
+                break
+            nodes *= 2
+        self.nodes = nodes
+        self._x = x.tolist()
+        # Polynomial coefficients of each interval and quantity as floats,
+        # scalar lookups then need no NumPy call
+        self._c = [[tuple(self._spline.c[:, k, j].tolist()) for j in range(len(QUANTITIES))]
+                   for k in range(nodes - 1)]
+
+    @staticmethod
+    def _saturation(P, fluid):
+        h_l, s_l, T = PropsSI_array(('H', 'S', 'T'), 'P', P, 'Q', 0, fluid)
+        h_g, s_g = PropsSI_array(('H', 'S'), 'P', P, 'Q', 1, fluid)
+        return np.array([h_l, h_g, s_l, s_g, T])
+
+    def covers(self, P):
+        return self.P_min <= P <= self.P_max
+
+    def _value(self, j, P):
+        if not isinstance(P, (float, int)):
+            return self._spline(np.log(P))[..., j]
+        x = math.log(P)
+        k = min(max(bisect.bisect_right(self._x, x) - 1, 0), len(self._x) - 2)
+        d = x - self._x[k]
+        c0, c1, c2, c3 = self._c[k][j]
+        return ((c0 * d + c1) * d + c2) * d + c3
+
+    def h_l(self, P):
+        return self._value(0, P)
+
+    def h_g(self, P):
+        return self._value(1, P)
+
+    def s_l(self, P):
+        return self._value(2, P)
+
+    def s_g(self, P):
+        return self._value(3, P)
+
+    def T(self, P):
+        return self._value(4, P)
+
+    def quality(self, P, h):
+        """Quality of the state (P, h), below 0 for subcooled liquid and
+        above 1 for superheated vapor
+        """
+        h_l = self.h_l(P)
+        return (h - h_l) / (self.h_g(P) - h_l)
+
+
+def saturation_table(fluid):
+    """Return the saturation table of a fluid, built on first use. Fluids
+    without a saturation curve of a pure fluid, incompressible fluids and
+    mixtures such as air, have no table and return None.
+    """
+    try:
+        return _tables[fluid]
+    except KeyError:
+        pass
+    backend, name = fluid.split('::', 1) if '::' in fluid else ('HEOS', fluid)
+    table = None
+    if 'HEOS' in backend and CP.get_fluid_param_string(name, 'pure') == 'true':
+        name = CP.get_fluid_param_string(name, 'name')
+        if name not in _names:
+            _names[name] = SaturationTable(name)
+        table = _names[name]
+    _tables[fluid] = table
+    return table
+
+
+if __name__ == '__main__':
+    import time
+    start = time.perf_counter()
+    table = saturation_table('Water')
+    print('Water table: {0} nodes, error {1:.1e}, built in {2:.3f} s'.format(
+        table.nodes, table.error, time.perf_counter() - start))
+    start = time.perf_counter()
+    for P in np.linspace(1e4, 1e7, 10000).tolist():
+        table.quality(P, 2e6)
+    t_table = time.perf_counter() - start
+    start = time.perf_counter()
+    for P in np.linspace(1e4, 1e7, 10000).tolist():
+        PropsSI('H', 'P', P, 'Q', 0, 'Water') <= 2e6 <= PropsSI('H', 'P', P, 'Q', 1, 'Water')
+    t_ps = time.perf_counter() - start
+    print('Phase check: table {0:.2f} us, PropsSI {1:.2f} us'.format(t_table / 1e-2, t_ps / 1e-2))
@@ -5,15 +5,49 @@
     Temperature, pressure, quality are interrelated. A flag `pressure_dependent` is set to identify whether the stream
     is pressure-dependent or temperature-dependent.
     """
-from CoolProp.CoolProp import PropsSI as ps
+from Props import PropsSI as ps, qualify
+from Saturation import saturation_table
 import Const
 
 
+class FlowRate:
+    """Mass flow rate, kg/s, held by reference so that the streams of one
+    flow path, e.g. the inlet and outlet of a component, share it, see
+    Stream.share_flow_rate. flow_rate[0] reads and writes the value.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise IndexError('A flow rate holds a single value!')
+        return self.value
+
+    def __setitem__(self, index, value):
+        if index != 0:
+            raise IndexError('A flow rate holds a single value!')
+        self.value = value
+
+    def __repr__(self):
+        return 'FlowRate({0})'.format(self.value)
+
+
 class Stream:
-    def __init__(self, fluid=Const.FLUID[1], flow_rate_value=0, pressure_dependent=True):
-        self.fluid = fluid      # Fluid type
-        self.flow_rate = [flow_rate_value]      # Mass flow rate, kg/s
-        """Flow rate is a list so that it is object-based"""
+    __slots__ = ('_cache', 'cache_hits', 'cache_misses', '_fluid', 'flow_rate',
+                 '_temperature', '_pressure', '_quality', 'pressure_dependent', 'backend')
+
+    def __init__(self, fluid=Const.FLUID[1], flow_rate_value=0, pressure_dependent=True, backend=None):
+        self._cache = {}
+        """Dependent properties already evaluated for the current state,
+           keyed on (fluid, temperature, pressure, quality, property)
+        """
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._fluid = fluid      # Fluid type
+        self.flow_rate = FlowRate(flow_rate_value)      # Mass flow rate, kg/s
+        """Flow rate is a FlowRate reference so that it is object-based"""
         self._temperature = None          # Temperature, K
         self._pressure = None          # Pressure, Pa
         self._quality = None
@@ -22,6 +56,19 @@ class Stream:
         """
         self.pressure_dependent = pressure_dependent
         # This is a flag to identify whether it is pressure-dependent or temperature-dependent
+        self.backend = backend
+        """Backend mode of the dependent properties, None, 'HEOS', 'TTSE' or
+           'BICUBIC', see Props.qualify
+        """
+
+    @property
+    def fluid(self):
+        return self._fluid
+
+    @fluid.setter
+    def fluid(self, fluid):
+        self._cache.clear()
+        self._fluid = fluid
 
     @property
     def temperature(self):
@@ -29,6 +76,7 @@ class Stream:
 
     @temperature.setter
     def temperature(self, temperature):
+        self._cache.clear()
         if temperature < 0:
             raise ValueError("Temperature should be higher than 0 K!")
         if self.pressure_dependent:
@@ -52,6 +100,7 @@ class Stream:
         """You may choose to make the judgement by temperature setter and
         comment the lines below, and uncomment the last line
         """
+        self._cache.clear()
         if temperature_celcius < -273.15:
             raise ValueError("Temperature should be higher than -273.15°C")
         if self.pressure_dependent:
@@ -73,6 +122,7 @@ class Stream:
 
     @pressure.setter
     def pressure(self, pressure):
+        self._cache.clear()
         if pressure < 0:
             raise ValueError("Absolute pressure should be higher than 0 Pa!")
         if self.pressure_dependent:
@@ -93,6 +143,7 @@ class Stream:
 
     @quality.setter
     def quality(self, quality):
+        self._cache.clear()
         if quality is None:
             self._quality = None
         elif 0 <= quality <= 1:
@@ -110,29 +161,91 @@ class Stream:
         else:
             raise ValueError("Wrong quality value!\nQuality should be a number between 0 and 1.")
 
+    def _property(self, name):
+        # Dependent properties only change with the state, so each one is
+        # evaluated once until one of the setters above clears the cache
+        fluid = qualify(self._fluid, self.backend)
+        key = (fluid, self._temperature, self._pressure, self._quality, name)
+        try:
+            value = self._cache[key]
+        except KeyError:
+            self.cache_misses += 1
+            value = ps(name, 'T', self._temperature, 'P', self._pressure, fluid) if (self._quality is None) else \
+                ps(name, 'P', self._pressure, 'Q', self._quality, fluid)
+            self._cache[key] = value
+        else:
+            self.cache_hits += 1
+        return value
+
+    def clear_cache(self):
+        self._cache.clear()
+
     @property
     def h(self):
-        return ps('H', 'T', self.temperature, 'P', self.pressure, self.fluid) if (self.quality is None) else \
-               ps('H', 'P', self.pressure, 'Q', self.quality, self.fluid)
+        return self._property('H')
 
     @property
     def s(self):
-        return ps('S', 'T', self._temperature, 'P', self.pressure, self.fluid) if (self.quality is None) else \
-               ps('S', 'P', self.pressure, 'Q', self.quality, self.fluid)
+        return self._property('S')
 
     @property
     def u(self):
-        return ps('U', 'T', self._temperature, 'P', self.pressure, self.fluid) if (self.quality is None) else \
-            ps('U', 'P', self.pressure, 'Q', self.quality, self.fluid)
+        return self._property('U')
 
     @property
     def cp(self):
-        return ps('C', 'T', self._temperature, 'P', self.pressure, self.fluid) \
-            if (self.quality is None) else float("inf")
+        return self._property('C') if (self.quality is None) else float("inf")
 
     def flow_to(self, stream):
         stream.fluid = self.fluid
-        stream.flow_rate = self.flow_rate
+        stream.share_flow_rate(self)
+
+    def share_flow_rate(self, stream):
+        """Make this stream refer to the flow rate of another stream, a
+        later change of either flow rate value applies to both
+        """
+        self.flow_rate = stream.flow_rate
+
+    def assign(self, stream):
+        """Take the fluid, state and flow rate value of another stream
+        """
+        self._cache.clear()
+        self._fluid = stream.fluid
+        self._temperature = stream.temperature
+        self._pressure = stream.pressure
+        self._quality = stream.quality
+        self.flow_rate[0] = stream.flow_rate[0]
+
+    def set_ph(self, pressure, h):
+        """Set the state from pressure and specific enthalpy. The stream is
+        two phase if h lies between the saturated liquid and vapor
+        enthalpies, single phase otherwise. The phase is looked up in the
+        saturation table of the fluid where it has one.
+        """
+        fluid = qualify(self._fluid, self.backend)
+        pressure = float(pressure)
+        h = float(h)
+        table = saturation_table(self._fluid)
+        if table is None or not table.covers(pressure):
+            table = None
+            try:
+                quality = ps('Q', 'P', pressure, 'H', h, fluid)
+            except ValueError:
+                # Incompressible fluids have no two phase region
+                quality = -1
+        else:
+            quality = table.quality(pressure, h)
+        self._cache.clear()
+        self._pressure = pressure
+        if 0 <= quality <= 1:
+            self._quality = float(quality)
+            if table is None:
+                self._temperature = ps('T', 'P', self._pressure, 'Q', self._quality, fluid)
+            else:
+                self._temperature = table.T(pressure)
+        else:
+            self._quality = None
+            self._temperature = ps('T', 'P', self._pressure, 'H', h, fluid)
 
     def mix(self, st1):
         st2 = Stream()
@@ -150,7 +263,7 @@ class Stream:
 
 if __name__ == '__main__':
     st = Stream()
-    st.flow_rate = [2]
+    st.flow_rate[0] = 2
     st.pressure_dependent = False
     st.pressure = 1e5
     st.temperature_celcius = 200
@@ -161,3 +274,17 @@ if __name__ == '__main__':
     print(st.h)
     print(st.s)
     print(st.cp)
+
+    # Memory per stream and rows of a shared state table
+    import tracemalloc
+    from StreamArray import StreamArray
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    streams = [Stream() for k in range(10000)]
+    print('{0:.0f} B per stream'.format((tracemalloc.get_traced_memory()[0] - start) / 10000))
+    tracemalloc.stop()
+    table = StreamArray(3)
+    table.pressure = 1e6
+    table[1].temperature = 500
+    table[1].flow_rate[0] = 4
+    print(table.temperature, table.flow_rate, table[1].h)
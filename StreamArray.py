@@ -0,0 +1,245 @@
+"""This class describes a batch of fluid streams of the same fluid, stored as
+    columnar NumPy arrays of temperature, pressure, quality and flow rate.
+    It follows the rules of `Stream`: temperature, pressure and quality can be
+    set, h, s, u, cp are dependent and evaluated for the whole batch at once.
+    The flag `pressure_dependent` decides, element by element, whether a
+    saturated stream follows its pressure or its temperature. A quality of NaN
+    plays the role of None in `Stream`, i.e. a single phase stream.
+    `array[i]` is a StreamView, a `Stream` that reads and writes element i,
+    so components can work on the rows of a shared state table in place.
+    The arrays returned by the getters are read-only views; a column is
+    changed by setting it as a whole or through the StreamView of an element,
+    so the dependent properties are never stale.
+    """
+import numpy as np
+from Props import PropsSI_array, qualify
+from Stream import Stream
+import Const
+
+
+def _readonly(values):
+    # Read-only view of an internal or cached array
+    view = values.view()
+    view.flags.writeable = False
+    return view
+
+
+class StreamArray:
+    def __init__(self, size, fluid=Const.FLUID[1], pressure_dependent=True, backend=None):
+        self._cache = {}
+        """Dependent properties already evaluated for the current state
+        """
+        self._fluid = fluid      # Fluid type
+        self.flow_rate = np.zeros(size)     # Mass flow rate, kg/s
+        self._temperature = np.full(size, np.nan)   # Temperature, K
+        self._pressure = np.full(size, np.nan)      # Pressure, Pa
+        self._quality = np.full(size, np.nan)
+        """Quality, [0, 1] for two phase stream; NaN for single
+           phase stream
+        """
+        self.pressure_dependent = pressure_dependent
+        # This is a flag to identify whether it is pressure-dependent or temperature-dependent
+        self.backend = backend
+        # Backend mode of the dependent properties, see Props.qualify
+
+    def __len__(self):
+        return self._temperature.size
+
+    def __getitem__(self, index):
+        if not isinstance(index, (int, np.integer)):
+            raise TypeError('A StreamArray is indexed by integers, one stream at a time!')
+        return StreamView(self, range(len(self))[index])
+
+    def _broadcast(self, values):
+        return np.broadcast_to(np.asarray(values, dtype=float), self._temperature.shape).copy()
+
+    def _saturation(self, output, name, values, mask):
+        # Saturation temperature or pressure of the elements in `mask`
+        result = np.full(mask.shape, np.nan)
+        result[mask] = PropsSI_array((output,), 'Q', self._quality[mask], name, values[mask], self._fluid)[0]
+        return result
+
+    @property
+    def fluid(self):
+        return self._fluid
+
+    @fluid.setter
+    def fluid(self, fluid):
+        self._cache.clear()
+        self._fluid = fluid
+
+    @property
+    def temperature(self):
+        return _readonly(self._temperature)
+
+    @temperature.setter
+    def temperature(self, temperature):
+        self._cache.clear()
+        temperature = self._broadcast(temperature)
+        if np.any(temperature < 0):
+            raise ValueError("Temperature should be higher than 0 K!")
+        saturated = ~np.isnan(self._quality)
+        if self.pressure_dependent:
+            if np.any(saturated & ~np.isnan(self._pressure)):
+                raise ValueError("The stream is set to be pressure-dependent.\n"
+                                 "Pressure and quality are already set, "
+                                 "please check!")
+            mask = saturated & np.isnan(self._pressure)
+        else:
+            mask = saturated
+        if np.any(mask):
+            self._pressure[mask] = self._saturation('P', 'T', temperature, mask)[mask]
+        self._temperature = temperature
+
+    @property
+    def temperature_celcius(self):
+        return self._temperature - 273.15
+
+    @temperature_celcius.setter
+    def temperature_celcius(self, temperature_celcius):
+        self.temperature = np.asarray(temperature_celcius, dtype=float) + 273.15
+
+    @property
+    def pressure(self):
+        return _readonly(self._pressure)
+
+    @pressure.setter
+    def pressure(self, pressure):
+        self._cache.clear()
+        pressure = self._broadcast(pressure)
+        if np.any(pressure < 0):
+            raise ValueError("Absolute pressure should be higher than 0 Pa!")
+        saturated = ~np.isnan(self._quality)
+        if self.pressure_dependent:
+            mask = saturated
+        else:
+            if np.any(saturated & ~np.isnan(self._temperature)):
+                raise ValueError("The stream is set to be temperature-dependent.\n"
+                                 "Temperature and quality are already set, "
+                                 "please check!")
+            mask = saturated & np.isnan(self._temperature)
+        if np.any(mask):
+            self._temperature[mask] = self._saturation('T', 'P', pressure, mask)[mask]
+        self._pressure = pressure
+
+    @property
+    def quality(self):
+        return _readonly(self._quality)
+
+    @quality.setter
+    def quality(self, quality):
+        self._cache.clear()
+        quality = self._broadcast(np.nan if quality is None else quality)
+        if np.any((quality < 0) | (quality > 1)):
+            raise ValueError("Wrong quality value!\nQuality should be a number between 0 and 1.")
+        self._quality = quality
+        saturated = ~np.isnan(quality)
+        has_pressure = saturated & ~np.isnan(self._pressure)
+        has_temperature = saturated & ~np.isnan(self._temperature)
+        if self.pressure_dependent:
+            from_pressure = has_pressure
+            from_temperature = has_temperature & ~has_pressure
+        else:
+            from_temperature = has_temperature
+            from_pressure = has_pressure & ~has_temperature
+        if np.any(from_pressure):
+            self._temperature[from_pressure] = self._saturation('T', 'P', self._pressure, from_pressure)[from_pressure]
+        if np.any(from_temperature):
+            self._pressure[from_temperature] = \
+                self._saturation('P', 'T', self._temperature, from_temperature)[from_temperature]
+
+    def _properties(self):
+        # h, s, u and cp of all elements are evaluated together, once per state
+        if not self._cache:
+            fluid = qualify(self._fluid, self.backend)
+            single = np.isnan(self._quality)
+            values = np.full((4,) + self._temperature.shape, np.nan)
+            values[:, single] = PropsSI_array(('H', 'S', 'U', 'C'), 'T', self._temperature[single],
+                                              'P', self._pressure[single], fluid)
+            values[:3, ~single] = PropsSI_array(('H', 'S', 'U'), 'P', self._pressure[~single],
+                                                'Q', self._quality[~single], fluid)
+            values[3, ~single] = np.inf
+            self._cache.update(zip(('h', 's', 'u', 'cp'), values))
+        return self._cache
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    @property
+    def h(self):
+        return _readonly(self._properties()['h'])
+
+    @property
+    def s(self):
+        return _readonly(self._properties()['s'])
+
+    @property
+    def u(self):
+        return _readonly(self._properties()['u'])
+
+    @property
+    def cp(self):
+        return _readonly(self._properties()['cp'])
+
+
+def _column(name):
+    # Attribute of a view on an element of a StreamArray column, NaN is None
+    def get(self):
+        value = getattr(self.array, name)[self.index]
+        return None if value != value else float(value)
+
+    def set(self, value):
+        self.array._cache.clear()
+        getattr(self.array, name)[self.index] = np.nan if value is None else value
+    return property(get, set)
+
+
+class StreamView(Stream):
+    """A stream whose temperature, pressure, quality and flow rate are the
+    elements `index` of a StreamArray. It behaves as a Stream of the fluid
+    of the array. Its flow rate stays in its element, so share_flow_rate
+    copies the value.
+    """
+    __slots__ = ('array', 'index')
+
+    def __init__(self, array, index):
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.array = array
+        self.index = index
+        self.pressure_dependent = array.pressure_dependent
+        self.backend = array.backend
+
+    _temperature = _column('_temperature')
+    _pressure = _column('_pressure')
+    _quality = _column('_quality')
+
+    @property
+    def _fluid(self):
+        return self.array.fluid
+
+    @_fluid.setter
+    def _fluid(self, fluid):
+        if fluid != self.array.fluid:
+            raise ValueError('All streams of a StreamArray have the same fluid!')
+
+    @property
+    def flow_rate(self):
+        return self.array.flow_rate[self.index:self.index + 1]
+
+    @flow_rate.setter
+    def flow_rate(self, flow_rate):
+        self.array.flow_rate[self.index] = flow_rate[0]
+
+
+if __name__ == '__main__':
+    st = StreamArray(5)
+    st.flow_rate[:] = 2
+    st.pressure = np.linspace(1e5, 1e7, 5)
+    st.temperature_celcius = 500
+    print(st.h)
+    st.quality = [0, 0.5, 1, 0.2, None]
+    print(st.temperature)
+    print(st.h)
+    print(st.cp)
@@ -0,0 +1,181 @@
+"""This module fits a response surface of DishCollector.get_T_o for uses that
+    need its answer many thousands of times per second, e.g. plant dispatch
+    optimization. The solver is sampled on a Latin hypercube over a domain of
+    irradiance, inlet temperature, flow rate, wind speed and ambient
+    temperature, and the outlet temperature is fitted by a polynomial of
+    total degree `degree` in Chebyshev polynomials of each variable scaled
+    to the domain. The fit is checked against the solver on independent
+    points, and points outside of the domain are solved by the solver.
+    """
+from collections import namedtuple
+import copy
+import itertools
+import pickle
+import warnings
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.stats import qmc
+from ResultCache import model_version
+
+
+VARIABLES = ('irradiance', 'T_i', 'flow_rate', 'wind_speed', 'T_amb')
+"""Variables of the surrogate: direct normal irradiance (W/m^2), inlet
+   temperature (K), flow rate (kg/s), wind speed (m/s), ambient temperature (K)
+"""
+
+DOMAIN = {'irradiance': (300, 1000), 'T_i': (350, 500), 'flow_rate': (0.04, 0.12),
+          'wind_speed': (0, 8), 'T_amb': (263.15, 313.15)}
+"""Default domain, the bounds of each variable"""
+
+ValidationError = namedtuple('ValidationError', ['max', 'rms', 'points', 'failed'])
+"""Maximum and root mean square error of the outlet temperature (K) on the
+   validation points that the solver solved, their number and the number
+   the solver failed on
+"""
+
+
+class DishSurrogate:
+    """Outlet temperature of dish collectors of the design of `dc`, with its
+    inlet pressure, as a polynomial of the VARIABLES over `domain` (DOMAIN
+    by default, a dict of bounds that may override some variables). The
+    solver is sampled on `samples` points and validated on `validation`
+    other points, over `processes` worker processes, see
+    DishCollector.solve_batch. `validation_error` is the ValidationError.
+    Samples the solver fails on are left out of the fit with a warning,
+    and points near them are out of the domain, so they are solved rather
+    than extrapolated. More than `max_failed` failed
+    samples raise ValueError.
+    """
+
+    def __init__(self, dc, domain=None, degree=5, samples=1024, validation=256, processes=1, seed=0,
+                 max_failed=0.2):
+        bounds = dict(DOMAIN)
+        if domain is not None:
+            unknown = set(domain) - set(VARIABLES)
+            if unknown:
+                raise ValueError('Unknown variables {0} of the surrogate domain!'.format(sorted(unknown)))
+            bounds.update(domain)
+        self.low = np.array([bounds[name][0] for name in VARIABLES], dtype=float)
+        self.high = np.array([bounds[name][1] for name in VARIABLES], dtype=float)
+        if np.any(self.high <= self.low):
+            raise ValueError('The upper bounds of the surrogate domain should be above the lower bounds!')
+        self.degree = degree
+        self._exponents = np.array([e for e in itertools.product(range(degree + 1), repeat=len(VARIABLES))
+                                    if sum(e) <= degree])
+        if samples < len(self._exponents):
+            raise ValueError('{0} samples are too few for the {1} terms of degree {2}!'.format(
+                samples, len(self._exponents), degree))
+        self._dc = copy.deepcopy(dc)     # Solver of the samples and of the points out of the domain
+        self.version = model_version()   # Model version the surrogate is fitted with
+        u_fit, T_fit = self._sample(samples, seed, processes)
+        u, T_o = self._sample(validation, seed + 1, processes)
+        failed = np.isnan(np.concatenate((T_fit, T_o)))
+        self.failed = int(np.count_nonzero(failed))     # Samples the solver failed on
+        self._tree = None       # Nearest sample search, None when no sample failed
+        if self.failed:
+            fraction = self.failed / failed.size
+            if fraction > max_failed:
+                raise ValueError('The solver failed on {0:.1%} of the samples, please narrow the domain!'.format(
+                    fraction))
+            warnings.warn('The solver failed on {0:.1%} of the samples, points near them are solved '
+                          'instead of fitted.'.format(fraction))
+            self._tree = cKDTree(np.concatenate((u_fit, u)))
+            self._failed = failed
+        fitted = ~np.isnan(T_fit)
+        self.coefficients = np.linalg.lstsq(self._basis(u_fit[fitted]), T_fit[fitted], rcond=None)[0]
+        solved = ~np.isnan(T_o)
+        error = self._basis(u[solved]) @ self.coefficients - T_o[solved]
+        self.validation_error = ValidationError(float(np.max(np.abs(error))) if error.size else np.nan,
+                                                float(np.sqrt(np.mean(error ** 2))) if error.size else np.nan,
+                                                int(np.count_nonzero(solved)),
+                                                int(np.count_nonzero(~solved)))
+
+    def _solve(self, x, processes=1):
+        # Outlet temperatures of the solver at points x of the VARIABLES
+        irradiance, T_i, flow_rate, wind_speed, T_amb = np.moveaxis(x, -1, 0)
+        return self._dc.solve_batch(irradiance, T_i, wind_speed, T_amb=T_amb, flow_rate=flow_rate,
+                                    processes=processes).T_o
+
+    def _sample(self, number, seed, processes):
+        # Scaled Latin hypercube points in [0, 1] and their outlet temperatures
+        u = qmc.LatinHypercube(len(VARIABLES), seed=seed).random(number)
+        return u, self._solve(self.low + u * (self.high - self.low), processes)
+
+    def _basis(self, u):
+        # Products of the Chebyshev polynomials of each scaled variable
+        vander = np.polynomial.chebyshev.chebvander(2 * u - 1, self.degree)
+        basis = vander[..., 0, self._exponents[:, 0]]
+        for j in range(1, len(VARIABLES)):
+            basis = basis * vander[..., j, self._exponents[:, j]]
+        return basis
+
+    def _inside(self, u):
+        # Scaled points in the box whose nearest samples, as many as to
+        # surround them, were all solved
+        points = u.reshape(-1, u.shape[-1])
+        inside = np.all((points >= 0) & (points <= 1), axis=-1)
+        if self._tree is not None and inside.any():
+            nearest = self._tree.query(points[inside], k=len(VARIABLES) + 1)[1]
+            inside[inside] = ~np.any(self._failed[nearest], axis=-1)
+        return inside.reshape(u.shape[:-1])
+
+    def inside(self, irradiance, T_i, flow_rate, wind_speed, T_amb):
+        """Whether the points lie in the domain of the surrogate, away from
+        the samples the solver failed on
+        """
+        x = np.stack(np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in
+                                           (irradiance, T_i, flow_rate, wind_speed, T_amb)]), axis=-1)
+        return self._inside((x - self.low) / (self.high - self.low))
+
+    def __call__(self, irradiance, T_i, flow_rate, wind_speed, T_amb, fallback=True):
+        """Outlet temperature (K) of the points, numbers or arrays that are
+        broadcast against each other. Points outside of the domain, see
+        `inside`, are solved by DishCollector.get_T_o, or are NaN without
+        `fallback`.
+        """
+        x = np.stack(np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in
+                                           (irradiance, T_i, flow_rate, wind_speed, T_amb)]), axis=-1)
+        u = (x - self.low) / (self.high - self.low)
+        inside = self._inside(u)
+        T_o = np.full(inside.shape, np.nan)
+        T_o[inside] = self._basis(u[inside]) @ self.coefficients
+        if fallback and not inside.all():
+            T_o[~inside] = self._solve(x[~inside])
+        return float(T_o) if T_o.ndim == 0 else T_o
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        """Load a saved surrogate, warns if the model code changed since
+        it was fitted
+        """
+        with open(path, 'rb') as f:
+            surrogate = pickle.load(f)
+        if surrogate.version != model_version():
+            warnings.warn('The model code changed since the surrogate in {0} was fitted!'.format(path))
+        return surrogate
+
+
+if __name__ == '__main__':
+    import time
+    from DishCollector import DishCollector
+    from Stream import Stream
+    import Const
+    dc = DishCollector()
+    dc.st_i = Stream(Const.FLUID[2])
+    dc.st_i.pressure = 4e5
+    dc.st_o = Stream(Const.FLUID[2])
+    start = time.perf_counter()
+    surrogate = DishSurrogate(dc, processes=4)
+    print('Fitted in {0:.1f} s, {1}'.format(time.perf_counter() - start, surrogate.validation_error))
+    # A year of hourly operating points
+    rng = np.random.default_rng(1)
+    points = [rng.uniform(low, high, 8760) for low, high in zip(surrogate.low, surrogate.high)]
+    start = time.perf_counter()
+    T_o = surrogate(*points)
+    print('8760 points in {0:.4f} s'.format(time.perf_counter() - start))
+    print('Surrogate {0:.3f} K, solver {1:.3f} K'.format(T_o[0], surrogate._solve(np.array(points)[:, 0])))
+    print('Outside of the domain, solved: {0:.3f} K'.format(surrogate(1100, 423.15, 0.07, 4, 288.15)))
@@ -0,0 +1,127 @@
+"""This module sweeps a cycle function over a grid of parameters, e.g. the
+    ideal Rankine cycle efficiency over inlet temperature x inlet pressure.
+    The grid points are split into chunks and spread over a pool of worker
+    processes. Each worker keeps its own Props handle pool and LRU cache for
+    all the chunks it evaluates, so the CoolProp backends are built once per
+    worker. A vectorized cycle function, e.g. one built on StreamArray,
+    takes the points of a whole chunk as arrays and evaluates them with
+    batched property calls. The result is labelled with the names and
+    coordinates of the parameters.
+    """
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, repeat
+import os
+import numpy as np
+import Props
+import Const
+
+
+class SweepResult:
+    """Values of a sweep on a grid, `values[i, j, ...]` belongs to
+    `coords[dims[0]][i]`, `coords[dims[1]][j]`, ... Points where the
+    cycle function raised ValueError are NaN.
+    """
+
+    def __init__(self, dims, coords, values):
+        self.dims = tuple(dims)
+        self.coords = coords
+        self.values = values
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def sel(self, **kwargs):
+        """Select the values at given coordinates, e.g.
+        result.sel(T_0=500) returns the values over the other parameters.
+        """
+        index = []
+        for dim in self.dims:
+            if dim in kwargs:
+                position = np.flatnonzero(np.isclose(self.coords[dim], kwargs[dim]))
+                if position.size == 0:
+                    raise ValueError('{0} = {1} is not on the grid!'.format(dim, kwargs[dim]))
+                index.append(position[0])
+            else:
+                index.append(slice(None))
+        return self.values[tuple(index)]
+
+    def to_xarray(self):
+        # xarray is optional, only needed for this conversion
+        import xarray
+        return xarray.DataArray(self.values, coords=[self.coords[dim] for dim in self.dims], dims=self.dims)
+
+    def __repr__(self):
+        return 'SweepResult(dims={0}, shape={1})'.format(self.dims, self.shape)
+
+
+def _init_worker(fluids):
+    # Build the property handles once per worker
+    for fluid in fluids:
+        Props.get_state(fluid)
+
+
+def _vector_values(func, dims, points):
+    # Values of a vectorized func at points, the parameters as 1-D arrays
+    values = np.asarray(func(**{dim: np.array(column, dtype=float) for dim, column in zip(dims, zip(*points))}),
+                        dtype=float)
+    if values.ndim == 0 or len(values) != len(points):
+        raise TypeError('A vectorized function should return one value per point, '
+                        'got {0} values for {1} points!'.format(values.size, len(points)))
+    return values
+
+
+def _run_chunk(func, dims, points, vectorized=False):
+    if vectorized:
+        try:
+            return _vector_values(func, dims, points).tolist()
+        except ValueError:
+            # Only the points that raise are NaN
+            values = []
+            for point in points:
+                try:
+                    values.append(float(_vector_values(func, dims, [point])[0]))
+                except ValueError:
+                    values.append(np.nan)
+            return values
+    values = []
+    for point in points:
+        try:
+            values.append(func(**dict(zip(dims, point))))
+        except ValueError:
+            values.append(np.nan)
+    return values
+
+
+def sweep(func, grid, processes=None, chunksize=None, fluids=(Const.FLUID[1],), vectorized=False):
+    """Evaluate `func(**point)` on every point of `grid`, a dict of
+    parameter names and their values, e.g.
+    sweep(ideal_efficiency, {'T_0': T, 'p_0': p}).
+    `func` must be defined at module level so it can be sent to the
+    worker processes. `processes` is the number of worker processes, all
+    cores by default, 1 evaluates in this process. `fluids` are warmed up
+    in each worker before the first chunk. A `vectorized` func takes 1-D
+    arrays of the parameters of the points of a chunk and returns their
+    values, one per point or TypeError is raised; the chunks then default
+    to one per worker. When a chunk raises ValueError its points are
+    evaluated one by one, each as arrays of one element.
+    """
+    dims = list(grid)
+    coords = {dim: np.asarray(grid[dim]) for dim in dims}
+    shape = tuple(coords[dim].size for dim in dims)
+    points = list(product(*(coords[dim].tolist() for dim in dims)))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        _init_worker(fluids)
+        values = _run_chunk(func, dims, points, vectorized)
+    else:
+        if chunksize is None:
+            chunksize = max(1, -(-len(points) // (processes if vectorized else processes * 4)))
+        chunks = [points[i:i + chunksize] for i in range(0, len(points), chunksize)]
+        values = []
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(fluids,)) as executor:
+            for chunk_values in executor.map(_run_chunk, repeat(func), repeat(dims), chunks, repeat(vectorized)):
+                values.extend(chunk_values)
+    values = np.asarray(values, dtype=float)
+    return SweepResult(dims, coords, values.reshape(shape + values.shape[1:]))
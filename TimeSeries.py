@@ -0,0 +1,152 @@
+"""This module runs a collector through a weather time series, e.g. the 8760
+    hours of a TMY year or a year at 1-minute resolution.
+    The weather file is a CSV file with a header and the columns `time`,
+    `irradiance` (direct normal irradiance, W/m^2), `temperature` (K) and,
+    optionally, `pressure` (Pa) and `wind_speed` (m/s). The records are read
+    and the results written in chunks, so the memory does not grow with the
+    length of the series. Steps whose irradiance is not above
+    `min_irradiance` are night steps, they are written without any property
+    call or solve.
+    """
+import csv
+import warnings
+import numpy as np
+from DishCollector import DishCollector
+from TroughCollector import TroughCollector
+
+
+def read_weather(path, chunksize=1000):
+    """Yield the records of a weather CSV file in lists of at most
+    `chunksize` dicts with float values, `time` is kept as text.
+    """
+    with open(path, newline='') as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            record = {'time': row['time'],
+                      'irradiance': float(row['irradiance']),
+                      'temperature': float(row['temperature'])}
+            if row.get('pressure'):
+                record['pressure'] = float(row['pressure'])
+            if row.get('wind_speed'):
+                record['wind_speed'] = float(row['wind_speed'])
+            chunk.append(record)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def dish_step(dc):
+    # Outlet temperature of a dish collector with known inlet state and flow rate
+    dc.get_T_o()
+    if not dc.converged:
+        raise RuntimeError(dc.message)
+    return {'T_o': dc.st_o.temperature, 'flow_rate': dc.st_i.flow_rate[0], 'q_use': dc.q_use}
+
+
+def trough_step(tc):
+    # Flow rate of a loop of tc.n trough collectors that heats the fluid
+    # from st_i.temperature up to st_o.temperature
+    flow_rate = tc.n * tc.A / (tc.w * tc.L_per_q_m)
+    if not flow_rate > 0:
+        raise RuntimeError('No positive flow rate reaches the outlet temperature!')
+    tc.st_i.flow_rate[0] = flow_rate
+    return {'T_o': tc.st_o.temperature, 'flow_rate': flow_rate,
+            'q_use': flow_rate * (tc.st_o.h - tc.st_i.h)}
+
+
+FIELDS = ['time', 'irradiance', 'T_o', 'flow_rate', 'q_use']
+
+
+def simulate(collector, chunks, step=None, min_irradiance=0):
+    """Yield a list of result dicts for each chunk of weather records.
+    `step(collector)` evaluates the collector once its ambient is set and
+    returns a dict of T_o, flow_rate and q_use, by default `dish_step` or
+    `trough_step`. Dish collectors are warm-started from the previous
+    step. A step that fails is NaN.
+    """
+    if step is None:
+        step = dish_step if isinstance(collector, DishCollector) else trough_step
+    if isinstance(collector, DishCollector):
+        collector.warm_start = True
+    amb = collector.amb
+    for chunk in chunks:
+        results = []
+        for record in chunk:
+            result = {'time': record['time'], 'irradiance': record['irradiance']}
+            if record['irradiance'] <= min_irradiance:
+                result.update(T_o=np.nan, flow_rate=0.0, q_use=0.0)
+                results.append(result)
+                continue
+            amb.irradiance = record['irradiance']
+            amb.temperature = record['temperature']
+            amb.pressure = record.get('pressure', amb.pressure)
+            amb.wind_speed = record.get('wind_speed', amb.wind_speed)
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    result.update(step(collector))
+            except (ValueError, TypeError, ArithmeticError, RuntimeError):
+                result.update(T_o=np.nan, flow_rate=np.nan, q_use=np.nan)
+            results.append(result)
+        yield results
+
+
+def run(collector, weather_path, output_path, step=None, chunksize=1000, min_irradiance=0):
+    """Run `collector` through the weather file and write one result row per
+    record to the CSV file `output_path`, chunk by chunk. Returns the
+    numbers of steps, day steps and failed steps.
+    """
+    summary = {'steps': 0, 'day_steps': 0, 'failures': 0}
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for results in simulate(collector, read_weather(weather_path, chunksize), step, min_irradiance):
+            writer.writerows(results)
+            f.flush()
+            for result in results:
+                summary['steps'] += 1
+                if result['irradiance'] > min_irradiance:
+                    summary['day_steps'] += 1
+                    if result['q_use'] != result['q_use']:
+                        summary['failures'] += 1
+    return summary
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+    import Const
+    # A synthetic hourly year of clear days
+    hours = np.arange(8760)
+    irradiance = np.clip(900 * np.sin(np.pi * ((hours % 24) - 6) / 12), 0, None)
+    temperature = 288.15 + 10 * np.sin(2 * np.pi * (hours / 8760 - 0.3)) + 5 * np.sin(np.pi * ((hours % 24) - 9) / 12)
+    with tempfile.TemporaryDirectory() as directory:
+        weather_path = os.path.join(directory, 'weather.csv')
+        with open(weather_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'irradiance', 'temperature', 'wind_speed'])
+            for h, G, T in zip(hours, irradiance, temperature):
+                writer.writerow([h, round(G, 1), round(T, 2), 4])
+
+        dc = DishCollector()
+        dc.st_i.fluid = Const.FLUID[2]
+        dc.st_i.temperature = Const.convert_temperature(150, 'C', 'K')
+        dc.st_i.pressure = 4e5
+        dc.st_i.flow_rate[0] = 0.07
+        dc.st_o.fluid = Const.FLUID[2]
+        start = time.perf_counter()
+        print(run(dc, weather_path, os.path.join(directory, 'dish.csv')),
+              '{0:.1f} s'.format(time.perf_counter() - start))
+
+        tc = TroughCollector()
+        tc.n = 3
+        tc.st_i.temperature = 400
+        tc.st_i.pressure = 2e6
+        tc.st_o.temperature = 500
+        tc.st_o.pressure = 2e6
+        start = time.perf_counter()
+        print(run(tc, weather_path, os.path.join(directory, 'trough.csv')),
+              '{0:.1f} s'.format(time.perf_counter() - start))
@@ -3,12 +3,48 @@ and uses vacuum receiver
 """
 from Ambient import Ambient
 from Stream import Stream
-from CoolProp import CoolProp
+from Props import PropsSI, PropsSI_array, qualify, split_fluid
+from collections import namedtuple
 import Const
+import Kernels
 import numpy as np
+import math
+
+
+MarchResult = namedtuple('MarchResult', ['x', 'T', 'q_gain', 'q_loss'])
+"""Segment-wise state along a row of trough collectors: node positions x (m)
+   and fluid temperatures T (K), absorbed and lost heat of each segment (W)
+"""
+
+
+def U_receiver(average_temperature, ambient_temperature):
+    """Overall heat transfer coefficient of the trough receiver, W/(m^2 K),
+    with the fluid average temperature and the ambient temperature in K.
+    Works on numbers and on arrays of any shape.
+    """
+    if np.ndim(average_temperature) == 0 and np.ndim(ambient_temperature) == 0:
+        return Kernels.U_receiver(average_temperature, ambient_temperature)
+    DeltaT = np.asarray(average_temperature) - ambient_temperature
+    (a0, b0, c0), (a1, b1, c1), (a2, b2, c2) = Kernels.U_RECEIVER
+    return np.where(average_temperature < 473.15,
+                    a0 + b0 * DeltaT + c0 * DeltaT ** 2,
+                    np.where(average_temperature > 573.15,
+                             a2 + b2 * DeltaT + c2 * DeltaT ** 2,
+                             a1 + b1 * DeltaT + c1 * DeltaT ** 2))
+
+
+def K_incidence(phi):
+    """Incidence angle coefficient of the trough collector with the
+    incidence angle phi in rad. Works on numbers and on arrays.
+    """
+    return Kernels.K_incidence(phi if np.ndim(phi) == 0 else np.asarray(phi, dtype=float))
 
 
 class TroughCollector:
+    backend = None      # Backend mode of the property calls, see Props.qualify
+    n = 0               # Number of the trough collectors in a loop
+    result_cache = None     # ResultCache of `calculate`, None to always calculate
+
     def __init__(self, A=545, w=5.76, v_min=1.1, v_max=2.9):
         self.n = self.n + 1
         self.A = A
@@ -43,21 +79,12 @@ class TroughCollector:
         # coefficient of trough receiver with the fluid average
         # temperature of T.
         average_temperature = (self.st_i.temperature + self.st_o.temperature) / 2
-        if average_temperature < 473.15:
-            return 0.687257 + 0.001941 * (average_temperature - self.amb.temperature) + \
-                0.000026 * (average_temperature - self.amb.temperature) ** 2
-        elif average_temperature > 573.15:
-            return 2.895474 - 0.0164 * (average_temperature - self.amb.temperature) + \
-                0.000065 * (average_temperature - self.amb.temperature) ** 2
-        else:
-            return 1.433242 - 0.00566 * (average_temperature - self.amb.temperature) + \
-                0.000046 * (average_temperature - self.amb.temperature) ** 2
+        return float(Kernels.U_receiver(average_temperature, self.amb.temperature))
 
     @property
     def K(self):
         # Used to calculate the incidence angle coefficient
-        return 1 - 2.23073e-4 * self.phi - 1.1e-4 * self.phi ** 2 \
-            + 3.18596e-6 * self.phi ** 3 - 4.85509e-8 * self.phi ** 4
+        return Kernels.K_incidence(self.phi)
 
     @property
     def L_per_q_m(self):
@@ -69,27 +96,125 @@ class TroughCollector:
         q = self.amb.irradiance * self.w * eta_opt_0 * self.K * self.Fe / para
         T = (self.st_i.temperature + self.st_o.temperature) / 2
         P = (self.st_i.pressure + self.st_o.pressure) / 2
-        cp = CoolProp.PropsSI('C', 'T', T, 'P', P, self.st_i.fluid)
+        cp = PropsSI('C', 'T', T, 'P', P, qualify(self.st_i.fluid, self.backend))
         U = self.U
         DeltaT_o = self.st_o.temperature - (self.amb.temperature + q / U)
         DeltaT_i = self.st_i.temperature - (self.amb.temperature + q / U)
         return - cp * np.log(DeltaT_o / DeltaT_i) / (U * para)
 
-    @property
     def calculate(self):
         # Calculate the number of trough collectors required and the
-        # actual speed in the pipe
-        self.n = 0
-        self.v = self.n * self.v_s
-        while self.v < self.v_min:
-            self.v = self.n * self.v_s
+        # actual speed in the pipe. The smallest number of collectors whose
+        # speed reaches v_min is found directly.
+        if self.result_cache is not None:
+            inputs = self._cache_inputs()
+            result = self.result_cache.get('TroughCollector', inputs)
+            if result is not None:
+                self.n, self.v, self.st_i.flow_rate[0] = result
+                self.st_o.share_flow_rate(self.st_i)
+                return
+        v_s = self.v_s
+        if not v_s > 0:
+            raise RuntimeError('No proper speed found!')
+        self.n = int(np.ceil(self.v_min / v_s))
+        self.v = self.n * v_s
         if self.v > self.v_max:
             raise RuntimeError('No proper speed found!')
         else:
-            self.st_i.dot_m = self.n * self.q_use / (self.st_o.h - self.st_i.h)
-            self.st_o.dot_m = self.st_i.dot_m
+            self.st_i.flow_rate[0] = self.n * self.A / (self.w * self.L_per_q_m)
+            self.st_o.share_flow_rate(self.st_i)
             # L = self.L_per_q_m * self.st_i.dot_m
             # self.n = L / (self.A / self.w)
+            if self.result_cache is not None:
+                self.result_cache.put('TroughCollector', inputs, [self.n, self.v, self.st_i.flow_rate[0]])
+
+    def _cache_inputs(self):
+        # Everything `calculate` depends on besides the model code
+        return [self.st_i.temperature, self.st_i.pressure, self.st_o.temperature, self.st_o.pressure,
+                split_fluid(qualify(self.st_i.fluid, self.backend)), self.amb.irradiance, self.amb.temperature,
+                self.A, self.w, self.v_min, self.v_max, self.rho, self.shading, self.tau, self.alpha, self.Fe,
+                self.d_i, self.d_o, self.phi, self.gamma]
+
+    def march(self, n_segments=100, length=None, flow_rate=None):
+        """Stream the fluid from st_i along a row of `length` m (the n
+        collectors of the loop by default) split into `n_segments`
+        segments and overwrite st_o.temperature with the outlet
+        temperature, with cp and U evaluated at the local temperature of
+        each segment instead of the lumped average used by L_per_q_m. The
+        heat balance of each segment is integrated exactly for its cp and
+        U. Returns a MarchResult.
+        """
+        if length is None:
+            length = self.n * self.A / self.w
+        if flow_rate is None:
+            flow_rate = self.st_i.flow_rate[0]
+        if not flow_rate > 0:
+            raise ValueError('The flow rate should be positive, e.g. from calculate()!')
+        para = np.pi * self.d_o
+        eta_opt_0 = self.rho * self.gamma * self.tau * self.alpha
+        q = self.amb.irradiance * self.w * eta_opt_0 * self.K * self.Fe / para
+        T_amb = self.amb.temperature
+        dx = length / n_segments
+        fluid = qualify(self.st_i.fluid, self.backend)
+        P_o = self.st_i.pressure if self.st_o.pressure is None else self.st_o.pressure
+        x = np.linspace(0, length, n_segments + 1)
+        P = np.linspace(self.st_i.pressure, P_o, n_segments + 1).tolist()
+        T = np.empty(n_segments + 1)
+        q_gain = np.full(n_segments, q * para * dx)
+        q_loss = np.empty(n_segments)
+        T_k = self.st_i.temperature
+        T[0] = T_k
+        for k in range(n_segments):
+            cp = PropsSI('C', 'T', T_k, 'P', (P[k] + P[k + 1]) / 2, fluid)
+            U = Kernels.U_receiver(T_k, T_amb)
+            T_inf = T_amb + q / U     # Temperature the fluid tends to
+            T_next = T_inf + (T_k - T_inf) * math.exp(-U * para * dx / (flow_rate * cp))
+            q_loss[k] = q_gain[k] - flow_rate * cp * (T_next - T_k)
+            T_k = T_next
+            T[k + 1] = T_k
+        self.st_o.temperature = T_k
+        return MarchResult(x, T, q_gain, q_loss)
+
+    def _L_per_q_m_and_density(self, T_i, T_o, phi):
+        # L_per_q_m and the fluid density over arrays of inlet and outlet
+        # temperatures and incidence angles, with one property call per state
+        para = np.pi * self.d_o
+        eta_opt_0 = self.rho * self.gamma * self.tau * self.alpha
+        q = self.amb.irradiance * self.w * eta_opt_0 * K_incidence(phi) * self.Fe / para
+        T = (T_i + T_o) / 2
+        P = (self.st_i.pressure + self.st_o.pressure) / 2
+        cp, density = PropsSI_array(('C', 'D'), 'T', T, 'P', P, qualify(self.st_i.fluid, self.backend))
+        U = U_receiver(T, self.amb.temperature)
+        DeltaT_o = T_o - (self.amb.temperature + q / U)
+        DeltaT_i = T_i - (self.amb.temperature + q / U)
+        return - cp * np.log(DeltaT_o / DeltaT_i) / (U * para), density
+
+    def L_per_q_m_array(self, T_i, T_o, phi=None):
+        """L_per_q_m over arrays of inlet and outlet temperatures (K) and
+        incidence angles (rad, the collector's phi by default), broadcast
+        against each other. Pressures are those of st_i and st_o.
+        """
+        T_i, T_o, phi = np.broadcast_arrays(np.asarray(T_i, dtype=float), np.asarray(T_o, dtype=float),
+                                            np.asarray(self.phi if phi is None else phi, dtype=float))
+        return self._L_per_q_m_and_density(T_i, T_o, phi)[0]
+
+    def sizing(self, T_i, T_o, phi=None):
+        """Number of trough collectors in a loop and the resulting average
+        speed, as `calculate` finds them, over arrays of inlet and outlet
+        temperatures (K) and incidence angles (rad). Both are NaN where no
+        proper speed is found.
+        """
+        T_i, T_o, phi = np.broadcast_arrays(np.asarray(T_i, dtype=float), np.asarray(T_o, dtype=float),
+                                            np.asarray(self.phi if phi is None else phi, dtype=float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            L_per_q_m, density = self._L_per_q_m_and_density(T_i, T_o, phi)
+            v_s = 4 * self.A / (self.w * L_per_q_m) / (density * np.pi * self.d_i ** 2)
+            n = np.ceil(self.v_min / v_s)
+            v = n * v_s
+        # A NaN speed, e.g. where the irradiance can not reach T_o, compares
+        # False and is not proper
+        proper = (v_s > 0) & (v <= self.v_max)
+        return np.where(proper, n, np.nan), np.where(proper, v, np.nan)
 
     @property
     def q_use(self):
@@ -110,8 +235,9 @@ class TroughCollector:
         fluid = self.st_i.fluid
         T = (self.st_i.temperature + self.st_o.temperature) / 2
         P = (self.st_i.pressure + self.st_o.pressure) / 2
-        density = CoolProp.PropsSI('D', 'T', T, 'P', P, fluid)
-        q_m_basic = self.q_use / (self.st_o.h - self.st_i.h)
+        density = PropsSI('D', 'T', T, 'P', P, qualify(fluid, self.backend))
+        # q_use / (st_o.h - st_i.h), the enthalpies cancel out
+        q_m_basic = self.A / (self.w * self.L_per_q_m)
         return 4 * q_m_basic / (density * np.pi * self.d_i ** 2)
 
 
@@ -121,3 +247,14 @@ if __name__ == '__main__':
     tc.st_i.pressure = 2e6
     tc.st_o.temperature = 500
     tc.st_o.pressure = 2e6
+    tc.calculate()
+    print(tc.n, tc.v, tc.st_i.flow_rate[0])
+    T_i, phi = np.meshgrid(np.linspace(380, 420, 50), np.deg2rad(np.linspace(0, 60, 20)))
+    n, v = tc.sizing(T_i, 500, phi)
+    print(np.nanmin(n), np.nanmax(n))
+    import time
+    for n_segments in (10, 100, 1000):
+        start = time.perf_counter()
+        result = tc.march(n_segments)
+        print('{0} segments: T_o = {1:.3f} K, {2:.3f} ms per row'.format(
+            n_segments, result.T[-1], (time.perf_counter() - start) * 1e3))
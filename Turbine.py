@@ -1,12 +1,24 @@
 """This class define steam turbine
       The steam turbine is a product, N-6 2.35, of Qingdao Jieneng Power
       Station Engineering Co., Ltd
+      The design point properties are evaluated once per design and backend.
+      Off-design, the flow rate and inlet pressure follow Stodola's cone law,
+      and `TurbineMap` interpolates the part-load performance over flow rate
+      and exhaust pressure, for whole arrays of operating points at once.
     """
+from collections import namedtuple
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
 from Stream import Stream
-from CoolProp.CoolProp import PropsSI
+from Props import PropsSI, PropsSI_array, qualify, split_fluid
 import Const
 
 
+DesignPoint = namedtuple('DesignPoint', ['h_i', 's_i', 'h_c_ideal', 'eta_i'])
+
+_design_points = {}     # Design points, keyed on the backend and fluid and the design constants
+
+
 class Turbine:
     _fluid_d = Const.FLUID[1]   # Designed working fluid
     _T_s_d = 663.15     # Designed main steam temperature, K
@@ -16,6 +28,7 @@ class Turbine:
     _power_d = 6e6      # Designed power
     _alpha = 0.1        # dependency factor of stages. P13 of "Simulation of
     # the part-load behavior of a 30 MWe SEGES plant"
+    backend = None      # Backend mode of the property calls, see Props.qualify
 
     def __init__(self, y=0, power=_power_d):
         self.st_i = Stream()
@@ -39,39 +52,140 @@ class Turbine:
     def power(self, power):
         self._power = power
 
+    def design_point(self):
+        """Return the main steam enthalpy and entropy, the isentropic exhaust
+        enthalpy and the internal efficiency at the design point. They are
+        evaluated once per design and backend.
+        """
+        fluid = qualify(self._fluid_d, self.backend)
+        # The backend the fluid is evaluated in, the process-wide mode included
+        key = (split_fluid(fluid), self._T_s_d, self._P_s_d, self._P_c_d, self._dot_m_d[0], self._power_d)
+        try:
+            return _design_points[key]
+        except KeyError:
+            h_i = PropsSI('H', 'T', self._T_s_d, 'P', self._P_s_d, fluid)
+            s_i = PropsSI('S', 'T', self._T_s_d, 'P', self._P_s_d, fluid)
+            h_c_ideal = PropsSI('H', 'S', s_i, 'P', self._P_c_d, fluid)
+            enthalpy_drop = self._power_d / self._dot_m_d[0]
+            design = DesignPoint(h_i, s_i, h_c_ideal, enthalpy_drop / (h_i - h_c_ideal))
+            _design_points[key] = design
+            return design
+
     @property
     def eta_i(self):
-        enthalpy_drop = self._power_d / self._dot_m_d[0]
-        h_i = PropsSI('H', 'T', self._T_s_d, 'P', self._P_s_d, self._fluid_d)
-#        h_c = h_i - enthalpy_drop
-        s_ideal = PropsSI('S', 'T', self._T_s_d, 'P', self._P_s_d,
-                          self._fluid_d)
-        h_c_ideal = PropsSI('H', 'S', s_ideal, 'P', self._P_c_d,
-                            self._fluid_d)
-        return enthalpy_drop / (h_i - h_c_ideal)
+        return self.design_point().eta_i
 
     def calculate_eta(self, p1, p2):
         return self.eta_i * (1 + self._alpha *
                              ((p1/self._P_s_d)/(p2/self._P_c_d) - 1) ** 2)
 
-    def get_st2(self, st1, pressure2):
-        st2 = Stream()
-        st2.fluid = st1.fluid
-        st2.flow_rate = st1.flow_rate
-        st2.pressure = pressure2
+    def cone_flow_rate(self, p1, p2, T1=None):
+        """Mass flow rate through the turbine with inlet pressure p1,
+        exhaust pressure p2 and inlet temperature T1 (design by default) by
+        Stodola's cone law. Works on numbers and on arrays.
+        """
+        if T1 is None:
+            T1 = self._T_s_d
+        return self._dot_m_d[0] * np.sqrt((p1 ** 2 - p2 ** 2) / (self._P_s_d ** 2 - self._P_c_d ** 2)
+                                          * self._T_s_d / T1)
+
+    def cone_inlet_pressure(self, flow_rate, p2, T1=None):
+        """Inlet pressure that passes `flow_rate` at exhaust pressure p2 and
+        inlet temperature T1 (design by default), i.e. the sliding pressure
+        of the cone law. Works on numbers and on arrays.
+        """
+        if T1 is None:
+            T1 = self._T_s_d
+        return np.sqrt(p2 ** 2 + (flow_rate / self._dot_m_d[0]) ** 2 * T1 / self._T_s_d
+                       * (self._P_s_d ** 2 - self._P_c_d ** 2))
+
+    def get_st2(self, st1, pressure2, out=None):
+        """Return the stream expanded from st1 to pressure2. The state is
+        written in place into `out` if given, e.g. tb.st_o_2.
+        """
         s_ideal = st1.s
-        h2_ideal = PropsSI('H', 'S', s_ideal, 'P', st2.pressure, st2.fluid)
-        eta = self.calculate_eta(st1.pressure, st2.pressure)
+        h2_ideal = PropsSI('H', 'S', s_ideal, 'P', pressure2, qualify(st1.fluid, self.backend))
+        eta = self.calculate_eta(st1.pressure, pressure2)
         h2 = st1.h - eta * (st1.h - h2_ideal)
-        # Check whether it is saturated
-        h2_l = PropsSI('H', 'P', st2.pressure, 'Q', 0, st2.fluid)
-        h2_g = PropsSI('H', 'P', st2.pressure, 'Q', 1, st2.fluid)
-        if h2_l <= h2 <= h2_g:
-            st2.quality = PropsSI('Q', 'P', st2.pressure, 'H', h2, st2.fluid)
-        else:
-            st2.temperature = PropsSI('T', 'P', st2.pressure, 'H', h2, st2.fluid)
+        st2 = Stream(backend=self.backend) if out is None else out
+        st2.backend = self.backend
+        st2.fluid = st1.fluid
+        st2.share_flow_rate(st1)
+        # The saturation table decides whether it is saturated
+        st2.set_ph(pressure2, h2)
         return st2
 
+    def expand(self, st1, pressures, fractions=()):
+        """Expand st1 through the stage groups between the extraction
+        pressures and the exhaust pressure `pressures[-1]`. `fractions[k]`
+        of the inlet flow rate is extracted at `pressures[k]`. All stage
+        groups run at the part-load efficiency of the whole turbine.
+        Returns the list of extraction and exhaust streams and the power.
+        """
+        if len(fractions) != len(pressures) - 1:
+            raise ValueError('Each extraction pressure needs an extraction fraction!')
+        if sum(fractions) >= 1:
+            raise ValueError('The extraction fractions should leave some exhaust steam!')
+        fluid = qualify(st1.fluid, self.backend)
+        eta = self.calculate_eta(st1.pressure, pressures[-1])
+        flow_rate = st1.flow_rate[0]
+        h, s, pressure = st1.h, st1.s, st1.pressure
+        streams = []
+        power = 0
+        for k, pressure2 in enumerate(pressures):
+            if pressure2 >= pressure:
+                raise ValueError('The extraction pressures should decrease!')
+            h2 = h - eta * (h - PropsSI('H', 'S', s, 'P', pressure2, fluid))
+            power += flow_rate * (h - h2)
+            st = Stream(backend=self.backend)
+            st.fluid = st1.fluid
+            st.set_ph(pressure2, h2)
+            extracted = st1.flow_rate[0] * fractions[k] if k < len(fractions) else flow_rate
+            st.flow_rate[0] = extracted
+            streams.append(st)
+            flow_rate -= extracted
+            h, s, pressure = h2, st.s, pressure2
+        return streams, power
+
+    def performance_map(self, flow_rates, pressures):
+        """Build a TurbineMap over the inlet flow rates and exhaust
+        pressures, with the main steam at design temperature and its
+        pressure sliding by the cone law.
+        """
+        return TurbineMap(self, flow_rates, pressures)
+
+
+PerformancePoint = namedtuple('PerformancePoint', ['p1', 'eta', 'h2', 'power'])
+
+
+class TurbineMap:
+    """Part-load performance of a turbine on a grid of inlet flow rates x
+    exhaust pressures, evaluated once with array property calls and then
+    interpolated by bicubic splines. `map(flow_rate, p2)` takes numbers or
+    arrays and returns the inlet pressure, efficiency, exhaust enthalpy
+    and power.
+    """
+
+    def __init__(self, turbine, flow_rates, pressures):
+        self.flow_rates = np.asarray(flow_rates, dtype=float)
+        self.pressures = np.asarray(pressures, dtype=float)
+        m, p2 = np.meshgrid(self.flow_rates, self.pressures, indexing='ij')
+        fluid = qualify(turbine._fluid_d, turbine.backend)
+        p1 = turbine.cone_inlet_pressure(m, p2)
+        h1, s1 = PropsSI_array(('H', 'S'), 'T', turbine._T_s_d, 'P', p1, fluid)
+        h2_ideal = PropsSI_array(('H',), 'S', s1, 'P', p2, fluid)[0]
+        eta = turbine.calculate_eta(p1, p2)
+        h2 = h1 - eta * (h1 - h2_ideal)
+        self._splines = [RectBivariateSpline(self.flow_rates, self.pressures, values)
+                         for values in (p1, eta, h2, m * (h1 - h2))]
+
+    def __call__(self, flow_rate, p2):
+        flow_rate, p2 = np.broadcast_arrays(np.asarray(flow_rate, dtype=float), np.asarray(p2, dtype=float))
+        values = [spline.ev(flow_rate, p2) for spline in self._splines]
+        if flow_rate.ndim == 0:
+            values = [float(value) for value in values]
+        return PerformancePoint(*values)
+
 
 if __name__ == '__main__':
     tb = Turbine()
@@ -86,3 +200,30 @@ if __name__ == '__main__':
     P2 = 20000
     st2 = tb.get_st2(tb.st_i, P2)
 
+    # Part load: sliding inlet pressure by the cone law
+    flow_rate = 0.6 * tb._dot_m_d[0]
+    print('Inlet pressure at 60 % flow rate: {0:.0f} Pa'.format(tb.cone_inlet_pressure(flow_rate, tb._P_c_d)))
+
+    # Two extractions and the exhaust
+    tb.st_i.flow_rate[0] = tb._dot_m_d[0]
+    streams, power = tb.expand(tb.st_i, [8e5, 2e5, tb._P_c_d], [0.1, 0.05])
+    print('Expansion with extractions: {0:.0f} W, exhaust quality {1:.4f}'.format(power, streams[-1].quality))
+
+    # Part-load map, queried for a year of hourly operating points at once
+    import time
+    start = time.perf_counter()
+    turbine_map = tb.performance_map(np.linspace(0.3, 1.1, 17) * tb._dot_m_d[0], np.linspace(8e3, 3e4, 12))
+    print('Map built in {0:.3f} s'.format(time.perf_counter() - start))
+    flow_rates = np.random.uniform(0.3, 1.1, 8760) * tb._dot_m_d[0]
+    pressures = np.random.uniform(8e3, 3e4, 8760)
+    start = time.perf_counter()
+    point = turbine_map(flow_rates, pressures)
+    print('8760 points in {0:.4f} s, mean power {1:.0f} W'.format(time.perf_counter() - start, point.power.mean()))
+    # Check against a direct evaluation
+    p1 = tb.cone_inlet_pressure(flow_rates[0], pressures[0])
+    st = Stream()
+    st.pressure = p1
+    st.temperature = tb._T_s_d
+    st.flow_rate[0] = flow_rates[0]
+    st2 = tb.get_st2(st, pressures[0])
+    print('Map {0:.1f} W, direct {1:.1f} W'.format(float(point.power[0]), flow_rates[0] * (st.h - st2.h)))
@@ -1,38 +1,31 @@
-from Stream import Stream
+from StreamArray import StreamArray
 import numpy as np
-from CoolProp.CoolProp import PropsSI as ps
+from Props import PropsSI as ps, PropsSI_array
 import matplotlib.pyplot as plt
 
-st = Stream()
-
 T0 = 100
 T1 = 600
 Delta_T = 50
 
-s0 = 1e5
-s1 = 1e8
+s0 = 1e2
+s1 = 1e4
 s_num = 1000
 S = np.linspace(s0, s1, s_num)
 
+st = StreamArray(s_num)
 for T in range(T0, T1, Delta_T):
     st.temperature_celcius = T
-    enthalpy = []
-    for i in range(s_num):
-        st.pressure = ps('P', 'S', S[i], 'T', st.temperature, 'water')
-        enthalpy.append(st.h)
-    plt.plot(S, enthalpy, label='$T$='+str(T)+'˚C')
-h0 = []
-h1 = []
+    st.pressure = PropsSI_array(('P',), 'S', S, 'T', T + 273.15, 'water')[0]
+    plt.plot(S, st.h, label='$T$='+str(T)+'˚C')
 num = 1000
-S_s =
+P0 = 1e3
+P_s = ps('P_CRITICAL', 'water')
 p = np.linspace(P0, P_s, num)
-for i in range(num):
-    h0.append(ps('H','Q', 0, 'P', p[i], 'water'))
-    h1.append(ps('H','Q', 1, 'P', p[i], 'water'))
-plt.plot(p, h0, '--', color = 'red')
-plt.plot(p, h1, '--', color = 'red')
+(s_l, s_g), (h0, h1) = PropsSI_array(('S', 'H'), 'Q', [[0], [1]], 'P', p, 'water')
+plt.plot(s_l, h0, '--', color='red')
+plt.plot(s_g, h1, '--', color='red')
 plt.legend(loc=1)
-plt.xlabel("Pressure, Pa")
+plt.xlabel("Entropy, J/(kg K)")
 plt.ylabel("Enthalpy, J/kg")
-plt.title('Water P-h diagram')
+plt.title('Water h-s diagram')
 plt.show()